@@ -7,12 +7,17 @@ from drivers.display_ssd1306 import SSD1306_I2C
 from drivers.sensor_sht31 import SHT31
 from drivers.rtc_ds3231 import DS3231
 from drivers.storage_sdcard import SDCard
+from drivers.storage_cache import SectorCache, WriteCoalescer
 from drivers.input_button import Button
 from drivers.output_led import LED
 
 from app.timekeeping import Timekeeper
+from app.logformat import SHT31_CHANNELS, sht31_channels
 from app.logging import SdLogger
+from app.rawlog import RawBlockLogger
+from app.sensors import SensorRegistry
 from app.ui import Ui
+from app.worker import Core1Worker, NullLock
 
 from app.safe_mode import (
     SafeModeManager,
@@ -21,6 +26,10 @@ from app.safe_mode import (
 )
 
 
+# give up on a conversion that hasn't delivered after this long
+_COLLECT_TIMEOUT_MS = 500
+
+
 class App:
     def __init__(self):
         # LEDs should come up early so we can signal errors immediately
@@ -29,7 +38,17 @@ class App:
         self.safe = SafeModeManager(self.red_led)
 
         self.experiment_running = False
+        self._last_on = None    # switch position last loop, changes wake the OLED
+        # sample in flight: triggered at last_sample_ms, collected later
+        self._sampling = False
+        self._sample_utc = ""
+        self._sample_epoch = 0
         self.last_sample_ms = time.ticks_ms()
+        # OFF screen: the clock is read at most once per UI frame
+        self._ui_interval_ms = 1000 // config.UI_MAX_FPS if config.UI_MAX_FPS else 0
+        self._last_off_ui_ms = time.ticks_add(self.last_sample_ms, -self._ui_interval_ms)
+        # guards the shared I2C bus once the OLED is driven from core 1
+        self.bus_lock = NullLock()
 
         # --- Button (should almost never fail) ---
         try:
@@ -69,22 +88,41 @@ class App:
                     self.i2c,
                     addr=config.OLED_I2C_ADDR,
                 )
-                self.ui = Ui(self.oled)
+                self.ui = Ui(
+                    self.oled,
+                    max_fps=config.UI_MAX_FPS,
+                    large_digits=config.UI_LARGE_DIGITS,
+                    history_decimate=config.UI_HISTORY_DECIMATE,
+                    dim_after_s=config.UI_DIM_AFTER_S,
+                    off_after_s=config.UI_OFF_AFTER_S,
+                    dim_contrast=config.UI_DIM_CONTRAST,
+                )
                 self.ui_ok = True
             except Exception as e:
                 self.safe.set_error(LEVEL_CRITICAL, "oled_init", e)
                 self.ui_ok = False
 
-        # --- Sensor ---
-        self.sensor_ok = False
-        self.sensor = None
+        # --- Sensors ---
+        self.sensors = SensorRegistry(timeout_ms=_COLLECT_TIMEOUT_MS, on_error=self._sensor_error)
         if self.i2c:
-            try:
-                self.sensor = SHT31(self.i2c, addr=config.SHT31_ADDR)
-                self.sensor_ok = True
-            except Exception as e:
-                self.safe.set_error(LEVEL_DEGRADED, "sht31_init", e)
-                self.sensor_ok = False
+            for n, addr in enumerate(config.SHT31_ADDRS):
+                # channel names follow the address, so a missing sensor
+                # doesn't rename the others: temp/rh, then temp_45/rh_45 ...
+                suffix = "_%02x" % addr if n else ""
+                try:
+                    sensor = SHT31(
+                        self.i2c,
+                        addr=addr,
+                        mps=config.SHT31_MPS,
+                        repeatability=config.SHT31_REPEATABILITY,
+                    )
+                except Exception as e:
+                    self.safe.set_error(LEVEL_DEGRADED, "sht31%s_init" % suffix, e)
+                    continue
+                self.sensors.add("sht31" + suffix, sensor, sht31_channels(suffix), display=True)
+        self.sensor_ok = len(self.sensors) > 0
+        # log schema = registered channels (no sensor: nothing gets logged anyway)
+        channels = self.sensors.channels or SHT31_CHANNELS
 
         # --- RTC ---
         self.rtc_ok = False
@@ -103,13 +141,48 @@ class App:
                 self.time = None
 
         # --- SD logger ---
-        self.sd_logger = SdLogger(mount_point=config.SD_MOUNT_POINT)
+        if config.LOG_BACKEND == "raw":
+            self.sd_logger = RawBlockLogger(
+                config.RAW_LOG_START_BLOCK,
+                config.RAW_LOG_BLOCKS,
+                channels=channels,
+                flush_records=config.LOG_FLUSH_RECORDS,
+                flush_ms=config.LOG_FLUSH_MS,
+            )
+        else:
+            self.sd_logger = SdLogger(
+                mount_point=config.SD_MOUNT_POINT,
+                fmt=config.LOG_FORMAT,
+                channels=channels,
+                buffer_sectors=config.LOG_BUFFER_SECTORS,
+                flush_records=config.LOG_FLUSH_RECORDS,
+                flush_ms=config.LOG_FLUSH_MS,
+                prealloc_bytes=config.LOG_PREALLOC_BYTES,
+                journal=config.LOG_JOURNAL,
+                segment_bytes=config.LOG_SEGMENT_BYTES,
+                segment_s=config.LOG_SEGMENT_S,
+                resume_ms=config.LOG_RESUME_MS,
+            )
         self.sd_ok = False
+        self.sd_baudrate = 0
         self._init_sd()
 
         # Show something at boot
         self._safe_ui_update(where="boot")
 
+        # --- Optional core 1 worker (SD logging + OLED) ---
+        self.worker = None
+        if config.DUAL_CORE:
+            try:
+                self.worker = Core1Worker(self, slots=config.CORE1_QUEUE_SLOTS)
+                self.bus_lock = self.worker.bus_lock
+                self.worker.start()
+            except Exception as e:
+                # stay single-core
+                self.safe.set_error(LEVEL_WARNING, "core1_start", e)
+                self.worker = None
+                self.bus_lock = NullLock()
+
     def _init_sd(self):
         try:
             self.spi = SPI(
@@ -122,8 +195,28 @@ class App:
                 miso=Pin(config.SD_MISO),
             )
             self.sd_cs = Pin(config.SD_CS, Pin.OUT)
-            sd = SDCard(self.spi, self.sd_cs, baudrate=config.SD_BAUDRATE)
-
+            sd = SDCard(
+                self.spi,
+                self.sd_cs,
+                baudrate=config.SD_BAUDRATE,
+                crc=config.SD_CRC,
+                retries=config.SD_RETRIES,
+            )
+            if config.SD_MAX_BAUDRATE > config.SD_BAUDRATE:
+                try:
+                    sd.negotiate(config.SD_SCRATCH_BLOCK, limit=config.SD_MAX_BAUDRATE)
+                except OSError as e:
+                    # keep whatever clock the card is at, it was verified
+                    # (or, without a safe scratch block, never changed)
+                    self.safe.set_error(LEVEL_WARNING, "sd_clock", e)
+            self.sd_baudrate = sd.baudrate
+
+            # the raw backend talks to the card directly
+            if config.LOG_BACKEND != "raw":
+                if config.SD_COALESCE_SECTORS:
+                    sd = WriteCoalescer(sd, config.SD_COALESCE_SECTORS)
+                if config.SD_CACHE_SECTORS:
+                    sd = SectorCache(sd, config.SD_CACHE_SECTORS)
             ok = self.sd_logger.mount(sd)
             self.sd_ok = bool(ok)
             if not self.sd_ok:
@@ -133,17 +226,21 @@ class App:
             self.safe.set_error(LEVEL_WARNING, "sd_init", e)
             self.sd_ok = False
 
-    def _utc_iso(self):
-        # If RTC fails, fallback to uptime-based timestamp
+    def _timestamp(self):
+        # If RTC fails, fallback to uptime-based timestamp (epoch 0 = unknown)
         if self.time:
             try:
-                return self.time.utc_iso()
+                with self.bus_lock:
+                    return self.time.stamp()
             except Exception as e:
                 self.safe.set_error(LEVEL_DEGRADED, "rtc_read", e)
 
         # fallback: ticks_ms
         ms = time.ticks_ms()
-        return "UPTIME_%dms" % ms
+        return "UPTIME_%dms" % ms, 0
+
+    def _utc_iso(self):
+        return self._timestamp()[0]
 
     def _safe_ui_update(self, where=""):
         """
@@ -177,6 +274,7 @@ class App:
                 self.safe.set_error(LEVEL_WARNING, "log_stop", e)
 
         self.experiment_running = False
+        self._sampling = False  # a sample still in flight is dropped
 
         # LEDs
         try:
@@ -185,21 +283,39 @@ class App:
         except Exception as e:
             self.safe.set_error(LEVEL_DEGRADED, "led_off_state", e)
 
-        # UI
+        # UI: the screen only changes once a second, no need to read the
+        # RTC (shared I2C bus) every loop
+        if not self.ui_ok:
+            return
+        now = time.ticks_ms()
+        if time.ticks_diff(now, self._last_off_ui_ms) < self._ui_interval_ms:
+            self._ui_tick()
+            return
+        self._last_off_ui_ms = now
+
+        # if there’s an active error, show it instead
+        if self.safe.level != LEVEL_OK:
+            self._safe_ui_update(where="off_loop")
+            return
+
+        if self.ui.panel_off:
+            # idle policy switched the panel off: no RTC reads for frames
+            # nobody sees (a switch change wakes it)
+            return
+
         utc_iso = self._utc_iso()
-        if self.ui_ok:
-            try:
-                self.ui.show_off(utc_iso)
-            except Exception as e:
-                self.safe.set_error(LEVEL_CRITICAL, "oled_show_off", e)
-                self.ui_ok = False
+        try:
+            self.ui.show_off(utc_iso)
+        except Exception as e:
+            self.safe.set_error(LEVEL_CRITICAL, "oled_show_off", e)
+            self.ui_ok = False
 
     def _set_on_state(self):
         if not self.experiment_running:
-            utc_iso = self._utc_iso()
+            utc_iso, epoch = self._timestamp()
             if self.sd_ok:
                 try:
-                    self.sd_logger.start_new(utc_iso)
+                    self.sd_logger.start_new(utc_iso, epoch)
                 except Exception as e:
                     # keep running without logging
                     self.safe.set_error(LEVEL_WARNING, "log_start", e)
@@ -223,25 +339,64 @@ class App:
             self.safe.set_error(LEVEL_DEGRADED, "button_read", e)
             return False
 
-    def _read_sensor(self):
-        if not self.sensor:
-            return None, None
-        try:
-            return self.sensor.read()
-        except Exception as e:
-            self.safe.set_error(LEVEL_DEGRADED, "sht31_read", e)
-            return None, None
+    def _sensor_error(self, name, e):
+        # one sensor failed this sample, the others are still logged
+        self.safe.set_error(LEVEL_DEGRADED, name + "_read", e)
+
+    def _start_sensor(self) -> bool:
+        # True if at least one conversion is now running
+        if not self.sensor_ok:
+            return False
+        with self.bus_lock:
+            return self.sensors.start_all()
+
+    def _collect_sensor(self):
+        # raw ticks of every channel, None if no sensor delivered, False while converting
+        with self.bus_lock:
+            if not self.sensors.collect_all():
+                return False
+        return self.sensors.values if self.sensors.ok else None
+
+    def _finish_sample(self, raw):
+        utc_iso = self._sample_utc
+
+        # log only if we have valid numbers
+        temp_c = rh = None
+        if raw is not None:
+            i = self.sensors.display_offset()
+            if i >= 0:
+                temp_c, rh = SHT31.convert(raw[i], raw[i + 1])
+            self._log_row(utc_iso, self._sample_epoch, self.last_sample_ms, raw)
+
+        # UI update, or error details if we’re in safe mode
+        if self.safe.level == LEVEL_OK:
+            self._show_on(temp_c, rh, utc_iso)
+        else:
+            self._safe_ui_update(where="on_loop")
 
-    def _log_row(self, utc_iso, temp_c, rh):
+    def _log_row(self, utc_iso, epoch, ticks_ms, raw):
         if not (self.sd_ok and self.experiment_running):
             return
         try:
-            self.sd_logger.write_row(utc_iso, temp_c, rh)
+            if self.sd_logger.binary:
+                self.sd_logger.write_record(epoch, ticks_ms, raw)
+            else:
+                self.sd_logger.write_row(utc_iso, raw, epoch)
         except Exception as e:
             self.safe.set_error(LEVEL_WARNING, "log_write", e)
             # disable further SD attempts this session
             self.sd_ok = False
 
+    def _ui_tick(self):
+        # draws a frame held back by the UI frame rate cap
+        if not self.ui_ok:
+            return
+        try:
+            self.ui.tick()
+        except Exception as e:
+            self.safe.set_error(LEVEL_CRITICAL, "oled_render", e)
+            self.ui_ok = False
+
     def _show_on(self, temp_c, rh, utc_iso):
         if not self.ui_ok:
             return
@@ -273,11 +428,13 @@ class App:
                 pass
 
             on = self._button_on()
+            if on != self._last_on:
+                self._last_on = on
+                if self.ui_ok:
+                    self.ui.wake()
 
             if not on:
                 self._set_off_state()
-                # if there’s an active error, show it
-                self._safe_ui_update(where="off_loop")
                 time.sleep_ms(50)
                 continue
 
@@ -285,20 +442,20 @@ class App:
             self._set_on_state()
 
             now = time.ticks_ms()
-            if time.ticks_diff(now, self.last_sample_ms) >= config.SAMPLE_INTERVAL_MS:
+            if not self._sampling and time.ticks_diff(now, self.last_sample_ms) >= config.SAMPLE_INTERVAL_MS:
                 self.last_sample_ms = now
-
-                temp_c, rh = self._read_sensor()
-                utc_iso = self._utc_iso()
-
-                # log only if we have valid numbers
-                if temp_c is not None and rh is not None:
-                    self._log_row(utc_iso, temp_c, rh)
-
-                # UI update (or safe mode screen)
-                self._show_on(temp_c, rh, utc_iso)
-
-                # show error details if we’re in safe mode
-                self._safe_ui_update(where="on_loop")
+                # the conversion runs while we read the RTC and do UI work
+                self._sampling = self._start_sensor()
+                self._sample_utc, self._sample_epoch = self._timestamp()
+                if not self._sampling:
+                    self._finish_sample(None)
+
+            self._ui_tick()
+
+            if self._sampling:
+                raw = self._collect_sensor()
+                if raw is not False:
+                    self._sampling = False
+                    self._finish_sample(raw)
 
             time.sleep_ms(10)
@@ -0,0 +1,190 @@
+# app/layout.py
+# Screen layouts for the OLED: static labels are rasterized once into a
+# background frame, dynamic fields are copied in from pre-rendered glyphs.
+# Everything sits on 8-pixel pages, so with the SSD1306's MONO_VLSB layout a
+# glyph column is one byte and drawing a character is a plain byte copy.
+from array import array
+
+import framebuf
+
+# what dynamic fields are made of (digits, dates, times, signs)
+DIGIT_CHARS = "0123456789.-:+ "
+
+
+class Glyphs:
+    """
+    8x8 font glyphs (scale 1) or 16x16 ones scaled up from it (scale 2),
+    rendered once. Characters outside the cache are drawn with framebuf.text.
+    """
+    def __init__(self, chars=DIGIT_CHARS, scale=1):
+        self.scale = scale
+        self.size = 8 * scale
+        self._glyphs = {}
+        small = bytearray(8)
+        fb = framebuf.FrameBuffer(small, 8, 8, framebuf.MONO_VLSB)
+        for ch in chars:
+            fb.fill(0)
+            fb.text(ch, 0, 0, 1)
+            self._glyphs[ch] = (bytes(small),) if scale == 1 else self._scale2(small)
+
+    @staticmethod
+    def _scale2(small):
+        # every pixel doubled: 16 columns x 2 pages as (top, bottom)
+        out = bytearray(32)
+        for c in range(8):
+            col = small[c]
+            wide = 0
+            for bit in range(8):
+                if col & (1 << bit):
+                    wide |= 3 << (2 * bit)
+            for k in (2 * c, 2 * c + 1):
+                out[k] = wide & 0xFF
+                out[16 + k] = wide >> 8
+        return bytes(out[:16]), bytes(out[16:])
+
+    def draw(self, buf, width, fb, text, x, page):
+        """
+        text at column x, top on page; fb is the FrameBuffer over buf (fallback).
+        """
+        n = self.size
+        for ch in text:
+            if x + n > width:
+                return
+            g = self._glyphs.get(ch)
+            if g is None:
+                if self.scale == 1:
+                    fb.text(ch, x, page * 8, 1)
+                else:
+                    fb.fill_rect(x, page * 8, n, n, 0)
+                    fb.text(ch, x + 4, page * 8 + 4, 1)
+            else:
+                for p in range(self.scale):
+                    o = (page + p) * width + x
+                    buf[o:o + n] = g[p]
+            x += n
+
+
+class Layout:
+    """
+    One screen: static labels + dynamic fields, all page aligned.
+
+        lay = Layout(128, 64)
+        lay.label("T:", 0, 2)
+        lay.field(24, 2)                 # field 0
+        lay.render(oled.buffer, oled.framebuf, ("21.5",))
+    """
+    def __init__(self, width, height, small=None, large=None):
+        self.width = width
+        self.height = height
+        self.small = small or Glyphs()
+        self.large = large
+        self._labels = []
+        self._fields = []
+        self._bg = None
+
+    def label(self, text, x, page):
+        self._labels.append((text, x, page))
+        self._bg = None
+
+    def field(self, x, page, large=False):
+        self._fields.append((x, page, large))
+
+    def _background(self):
+        bg = bytearray(self.width * self.height // 8)
+        fb = framebuf.FrameBuffer(bg, self.width, self.height, framebuf.MONO_VLSB)
+        for text, x, page in self._labels:
+            fb.text(text, x, page * 8, 1)
+        return bg
+
+    def render(self, buf, fb, values):
+        """
+        Background copied into buf (the display framebuffer), then values[i]
+        drawn into field i.
+        """
+        if self._bg is None:
+            self._bg = self._background()
+        buf[:] = self._bg
+        fields = self._fields
+        for i in range(len(fields)):
+            x, page, large = fields[i]
+            glyphs = self.large if large else self.small
+            glyphs.draw(buf, self.width, fb, values[i], x, page)
+
+
+class Sparkline:
+    """
+    Scrolling history graph of one value, kept in its own small framebuffer
+    and blitted onto the screen. add() averages `decimate` samples into one
+    point; each point scrolls the graph one pixel left and draws one new
+    column. Points (in tenths) also go into a preallocated ring, used only
+    to redraw everything when a point leaves the vertical range, which then
+    grows to fit it.
+    """
+    def __init__(self, width, height, lo, hi, decimate=1):
+        self.width = width
+        self.height = height
+        self.fb = framebuf.FrameBuffer(
+            bytearray(width * ((height + 7) // 8)), width, height, framebuf.MONO_VLSB)
+        self._lo = int(lo * 10)
+        self._hi = int(hi * 10)
+        self.decimate = decimate
+        self._ring = array("h", bytes(2 * width))
+        self._head = 0          # next slot
+        self._count = 0
+        self._sum = 0
+        self._nsum = 0
+        self._prev_y = -1
+
+    def _y(self, v):
+        return self.height - 1 - (v - self._lo) * (self.height - 1) // (self._hi - self._lo)
+
+    def _column(self, x, y):
+        # joined to the previous point so steep changes stay visible
+        p = self._prev_y
+        if p < 0:
+            self.fb.pixel(x, y, 1)
+        elif p < y:
+            self.fb.vline(x, p, y - p + 1, 1)
+        else:
+            self.fb.vline(x, y, p - y + 1, 1)
+        self._prev_y = y
+
+    def _redraw(self):
+        self.fb.fill(0)
+        self._prev_y = -1
+        n = self._count
+        w = self.width
+        for i in range(n):
+            v = self._ring[(self._head - n + i) % w]
+            self._column(w - n + i, self._y(v))
+
+    def add(self, value) -> bool:
+        """
+        One sample. True when the graph changed (a new point was drawn).
+        """
+        self._sum += int(value * 10)
+        self._nsum += 1
+        if self._nsum < self.decimate:
+            return False
+        v = self._sum // self._nsum
+        self._sum = 0
+        self._nsum = 0
+
+        w = self.width
+        self._ring[self._head] = v
+        self._head = (self._head + 1) % w
+        if self._count < w:
+            self._count += 1
+
+        if v < self._lo or v > self._hi:
+            if v < self._lo:
+                self._lo = v
+            else:
+                self._hi = v
+            self._redraw()
+            return True
+
+        self.fb.scroll(-1, 0)
+        self.fb.vline(w - 1, 0, self.height, 0)     # scroll leaves the old column
+        self._column(w - 1, self._y(v))
+        return True
@@ -0,0 +1,235 @@
+# app/logformat.py
+# Binary log layout shared with data-analysis/binlog.py (keep the two in sync)
+import binascii
+import struct
+
+MAGIC = b"BRLG"
+VERSION = 1
+JOURNAL_VERSION = 2     # records grouped in CRC-checked, sector-sized batches
+DELTA_VERSION = 3       # journal batches holding delta/varint coded records (DeltaEncoder)
+
+# magic, version, channel count, record size, header size, record count
+# record count is 0 while a file is being written ("read to EOF")
+_HEADER_FMT = "<4sBBHHI"
+HEADER_FIXED_SIZE = struct.calcsize(_HEADER_FMT)
+COUNT_OFFSET = 10  # patched in place when a file is closed cleanly
+
+# every record starts with seq, epoch (s since 2000), ticks_ms as u32
+_RECORD_PREFIX = "<III"
+
+# Journaled files: header padded to one sector, then one batch per sector:
+#   payload bytes, flags, file key, batch seq, crc32 (header[0:12] + payload)
+#   followed by whole records. The key tells batches of this file apart from
+#   stale ones left in reused clusters.
+BATCH_SIZE = 512
+_BATCH_FMT = "<HHII"
+BATCH_HEADER_SIZE = 16
+
+# per-record validity: bit i set = channel i holds a reading this sample.
+# Logged as one more u16 channel, so files without it read as all valid.
+MASK_CHANNEL = ("valid", "mask")
+
+
+def sht31_channels(suffix=""):
+    # (name, kind) - kind tells the host how to turn ticks into physical units
+    return (
+        ("temp" + suffix, "sht31_t"),
+        ("rh" + suffix, "sht31_rh"),
+    )
+
+
+SHT31_CHANNELS = sht31_channels()
+
+# kind -> (csv column unit, ticks -> physical units) for csv logs; the csv
+# column of channel "temp" is "temp_c". Same formulas as CONVERSIONS/UNITS in
+# data-analysis/binlog.py
+CSV_UNITS = {
+    "sht31_t": ("c", lambda t: -45 + 175 * t / 65535.0),
+    "sht31_rh": ("percent", lambda rh: 100 * rh / 65535.0),
+}
+
+
+def csv_columns(channels):
+    """
+    (header line, [(channel index, conversion or None for raw ticks)],
+    index of the mask channel or -1) of a csv log with these channels.
+    """
+    names = ["utc_iso"]
+    columns = []
+    mask = -1
+    for i, (name, kind) in enumerate(channels):
+        if kind == MASK_CHANNEL[1]:
+            mask = i
+            continue
+        unit = CSV_UNITS.get(kind)
+        names.append(name + "_" + unit[0] if unit else name)
+        columns.append((i, unit[1] if unit else None))
+    return (",".join(names) + "\n").encode(), columns, mask
+
+
+class RecordFormat:
+    """
+    Fixed-size little-endian records: seq, epoch, ticks_ms, then one u16 per channel.
+    File = header (fixed part + "name:kind,..." channel table) followed by records.
+    """
+    def __init__(self, channels=SHT31_CHANNELS):
+        self.channels = tuple(channels)
+        self.fmt = _RECORD_PREFIX + "H" * len(self.channels)
+        self.record_size = struct.calcsize(self.fmt)
+
+    def header(self, count=0, version=VERSION) -> bytes:
+        table = ",".join("%s:%s" % ch for ch in self.channels).encode()
+        size = HEADER_FIXED_SIZE + len(table)
+        pad = b""
+        if version >= JOURNAL_VERSION:
+            # journaled: batches start on a sector boundary
+            pad = bytes(BATCH_SIZE - size)
+            size = BATCH_SIZE
+        return struct.pack(
+            _HEADER_FMT, MAGIC, version,
+            len(self.channels), self.record_size, size, count,
+        ) + table + pad
+
+    def pack_into(self, buf, offset, seq, epoch, ticks_ms, values):
+        struct.pack_into(self.fmt, buf, offset, seq, epoch, ticks_ms, *values)
+
+
+def parse_header(buf):
+    """
+    (version, nchan, record_size, header_size, count) or None if buf isn't a log header.
+    """
+    magic, version, nchan, record_size, size, count = struct.unpack_from(_HEADER_FMT, buf)
+    if magic != MAGIC:
+        return None
+    return version, nchan, record_size, size, count
+
+
+def _batch_crc(buf, nbytes):
+    mv = memoryview(buf)
+    crc = binascii.crc32(mv[0:12])
+    return binascii.crc32(mv[BATCH_HEADER_SIZE:BATCH_HEADER_SIZE + nbytes], crc)
+
+
+def check_batch(buf, key, seq) -> int:
+    """
+    Payload size of a valid batch with this key/seq, -1 otherwise.
+    """
+    nbytes, flags, k, s = struct.unpack_from(_BATCH_FMT, buf)
+    if k != key or s != seq or nbytes > BATCH_SIZE - BATCH_HEADER_SIZE:
+        return -1
+    if struct.unpack_from("<I", buf, 12)[0] != _batch_crc(buf, nbytes):
+        return -1
+    return nbytes
+
+
+class Journal:
+    """
+    One preallocated sector that records are packed into; seal() stamps the
+    batch header + CRC so the sector can go to the card as is.
+    """
+    def __init__(self, record_size):
+        self.buf = bytearray(BATCH_SIZE)
+        self.limit = BATCH_HEADER_SIZE + (
+            (BATCH_SIZE - BATCH_HEADER_SIZE) // record_size * record_size)
+        self.fill = BATCH_HEADER_SIZE
+        self.key = 0
+        self.seq = 0
+
+    def reset(self, key) -> None:
+        self.key = key
+        self.seq = 0
+        self.fill = BATCH_HEADER_SIZE
+
+    def empty(self) -> bool:
+        return self.fill == BATCH_HEADER_SIZE
+
+    def full(self) -> bool:
+        return self.fill >= self.limit
+
+    def seal(self) -> None:
+        nbytes = self.fill - BATCH_HEADER_SIZE
+        struct.pack_into(_BATCH_FMT, self.buf, 0, nbytes, 0, self.key, self.seq)
+        struct.pack_into("<I", self.buf, 12, _batch_crc(self.buf, nbytes))
+
+    def next(self) -> None:
+        self.seq += 1
+        self.fill = BATCH_HEADER_SIZE
+
+
+def _put_uvarint(buf, pos, v):
+    while v >= 0x80:
+        buf[pos] = (v & 0x7F) | 0x80
+        v >>= 7
+        pos += 1
+    buf[pos] = v
+    return pos + 1
+
+
+def _put_svarint(buf, pos, v):
+    # zigzag: small magnitudes of either sign -> small varints
+    return _put_uvarint(buf, pos, (v << 1) if v >= 0 else (((-v) << 1) - 1))
+
+
+class DeltaEncoder:
+    """
+    Record codec for DELTA_VERSION files. Every batch opens with a keyframe
+    (first seq, then epoch, ticks_ms and channel ticks as plain varints), so
+    each sector decodes on its own. Further records are zigzag varints of the
+    epoch delta, ticks_ms delta-of-delta and one delta per channel; seq is
+    implicit (+1). A steady 1 Hz SHT31 record takes ~4 bytes instead of 16.
+    Encodes straight into the batch buffer and allocates nothing.
+    """
+    def __init__(self, nchan):
+        self.nchan = nchan
+        self.max_record = 5 * (nchan + 3)   # worst case (keyframe incl. seq)
+        self.keyframe = True
+        self._prev = [0] * (nchan + 2)      # epoch, ticks_ms, channels
+        self._prev_dt = 0
+
+    def encode_into(self, buf, pos, seq, epoch, ticks_ms, values) -> int:
+        """
+        Appends one record at buf[pos:], returns the new end position.
+        """
+        prev = self._prev
+        if self.keyframe:
+            pos = _put_uvarint(buf, pos, seq)
+            pos = _put_uvarint(buf, pos, epoch)
+            pos = _put_uvarint(buf, pos, ticks_ms)
+            for i in range(self.nchan):
+                pos = _put_uvarint(buf, pos, values[i])
+            self._prev_dt = 0
+            self.keyframe = False
+        else:
+            pos = _put_svarint(buf, pos, epoch - prev[0])
+            dt = ticks_ms - prev[1]
+            pos = _put_svarint(buf, pos, dt - self._prev_dt)
+            self._prev_dt = dt
+            for i in range(self.nchan):
+                pos = _put_svarint(buf, pos, values[i] - prev[2 + i])
+        prev[0] = epoch
+        prev[1] = ticks_ms
+        for i in range(self.nchan):
+            prev[2 + i] = values[i]
+        return pos
+
+    def scan_batch(self, buf, nbytes):
+        """
+        (first seq, record count, epoch of last record) of one sealed batch.
+        Used by crash recovery, not on the hot path.
+        """
+        ints = []
+        v = shift = 0
+        for i in range(BATCH_HEADER_SIZE, BATCH_HEADER_SIZE + nbytes):
+            b = buf[i]
+            v |= (b & 0x7F) << shift
+            shift += 7
+            if not b & 0x80:
+                ints.append(v)
+                v = shift = 0
+        width = self.nchan + 2
+        count = (len(ints) - 1) // width
+        epoch = ints[1]
+        for r in range(1, count):
+            d = ints[1 + r * width]
+            epoch += (d >> 1) if not d & 1 else -((d + 1) >> 1)
+        return ints[0], count, epoch
@@ -1,16 +1,150 @@
+import struct
+import time
 import uos as os
 
+from app.logformat import (
+    RecordFormat, Journal, DeltaEncoder, SHT31_CHANNELS, COUNT_OFFSET, csv_columns,
+    VERSION, JOURNAL_VERSION, DELTA_VERSION, BATCH_SIZE, parse_header, check_batch,
+)
+
+SECTOR_SIZE = 512
+
+
+class SectorRing:
+    """
+    Preallocated RAM ring of whole sectors.
+    put() copies bytes in, drain() hands them to a file in as few writes as possible.
+    """
+    def __init__(self, sectors=4):
+        self.capacity = sectors * SECTOR_SIZE
+        self._buf = bytearray(self.capacity)
+        self._mv = memoryview(self._buf)
+        self._head = 0      # next write index
+        self.used = 0
+
+    def free(self) -> int:
+        return self.capacity - self.used
+
+    def put(self, data) -> None:
+        n = len(data)
+        if n > self.capacity - self.used:
+            raise OSError("log buffer overrun")
+        src = memoryview(data)
+        first = min(n, self.capacity - self._head)
+        self._mv[self._head:self._head + first] = src[:first]
+        if first < n:
+            self._mv[0:n - first] = src[first:]
+        self._head = (self._head + n) % self.capacity
+        self.used += n
+
+    def drain(self, f, n) -> None:
+        """
+        Write the oldest n buffered bytes to f (at most two writes when wrapped).
+        """
+        tail = (self._head - self.used) % self.capacity
+        first = min(n, self.capacity - tail)
+        f.write(self._mv[tail:tail + first])
+        if first < n:
+            f.write(self._mv[0:n - first])
+        self.used -= n
+
+    def clear(self) -> None:
+        self._head = 0
+        self.used = 0
+
 
 class SdLogger:
     """
-    Handles SD mount + CSV file lifecycle.
+    Handles SD mount + log file lifecycle.
+    fmt="csv": human readable rows, one column per channel in physical units
+    (empty where the validity mask says the sensor missed the sample),
+    fmt="bin": fixed-size records (app/logformat.py),
+    fmt="delta": delta/varint coded records (always journaled, see DeltaEncoder).
+
+    Rows are collected in a SectorRing and only reach the card as whole,
+    sector-aligned chunks when the ring fills up, or on sync(): every
+    flush_records rows, every flush_ms, and on stop().
+
+    Binary files are preallocated to prealloc_bytes (or taken from the slots
+    laid out by data-analysis/prepare_card.py), so appends inside that space
+    never touch the FAT. VfsFat files can't be truncated, so stop() records
+    the real length as the record count in the header instead. Preallocated
+    files are always journaled (see below).
+
+    journal=True (binary only) packs records into CRC-checked, sector-sized
+    batches (app/logformat.py), kept in RAM while they fill. sync() writes
+    the open batch to its sector as far as it goes; later syncs rewrite that
+    same sector (same batch seq, new length + CRC) until the batch is full
+    and the next one starts in the next sector. Inside a preallocated file
+    sync() doesn't need to commit FAT/directory at all: after a power cut
+    mount() finds the last valid batch and repairs the header, so at most
+    the batch being filled is lost.
+
+    A session (OFF->ON) is split into segment files
+    <start>_<nnn>.<ext> once a file reaches segment_bytes or segment_s; a
+    restart within resume_ms of stop() reopens the segment stop() closed
+    and appends to it, so a jittery switch doesn't scatter tiny files.
+    Every segment open/close/resume is appended to manifest.csv
+    (event,session,segment,file,epoch,records) so host tools can pick files
+    by time without listing the card.
     """
-    def __init__(self, mount_point="/sd"):
+    def __init__(self, mount_point="/sd", fmt="csv", channels=SHT31_CHANNELS,
+                 buffer_sectors=4, flush_records=64, flush_ms=5000, prealloc_bytes=0,
+                 journal=False, segment_bytes=0, segment_s=0, resume_ms=0):
         self.mount_point = mount_point
         self.sd_ok = False
         self._mounted = False
+        self._dev = None
         self._file = None
         self._path = None
+        self._manifest = mount_point + "/manifest.csv"
+
+        self.segment_bytes = segment_bytes
+        self.segment_s = segment_s
+        self.resume_ms = resume_ms
+        self._session_id = 0
+        self._session_name = None
+        self._segment = 0
+        self._seg_start_ms = 0
+        self._last_epoch = 0
+        self._stopped_ms = time.ticks_ms()
+        self._stopped_path = None   # segment stop() closed, reopened on a quick restart
+
+        self.binary = fmt in ("bin", "delta")
+        self.prealloc_bytes = prealloc_bytes
+        self._format = RecordFormat(channels)
+        self._record = bytearray(self._format.record_size)
+        self._csv_header, self._csv_columns, self._csv_mask = csv_columns(channels)
+        self._seq = 0
+        self._delta = None
+        self._version = VERSION
+        self._journal = None
+        if fmt == "delta":
+            # the batch framing is what makes varint records seekable
+            self._delta = DeltaEncoder(len(self._format.channels))
+            self._journal = Journal(1)  # variable-size records: byte granularity
+            self._version = DELTA_VERSION
+        elif self.binary and (journal or prealloc_bytes):
+            # a preallocated file that wasn't closed ends in whatever the
+            # reused clusters held, possibly records of an older log in the
+            # same layout; only the per-file batch key tells them apart
+            self._journal = Journal(self._format.record_size)
+            self._version = JOURNAL_VERSION
+        self._alloc_end = 0
+        self._batch_written = 0     # journal fill already on the card
+
+        self._ring = SectorRing(buffer_sectors)
+        self.flush_records = flush_records
+        self.flush_ms = flush_ms
+        self._file_pos = 0
+        self._since_sync = 0
+        self._last_sync_ms = time.ticks_ms()
+
+        # counters
+        self.bytes_written = 0
+        self.flush_count = 0
+        self.last_flush_us = 0
+        self.max_flush_us = 0
 
     def mount(self, sdcard_block_device) -> bool:
         """
@@ -19,53 +153,370 @@ class SdLogger:
         """
         try:
             vfs = os.VfsFat(sdcard_block_device)
+            self._dev = sdcard_block_device
             os.mount(vfs, self.mount_point)
             self.sd_ok = True
             self._mounted = True
-            return True
         except Exception:
             self.sd_ok = False
             self._mounted = False
             return False
 
-    def start_new(self, start_utc_iso: str) -> str | None:
+        try:
+            last = self._manifest_tail()
+            if not last:
+                with open(self._manifest, "w") as f:
+                    f.write("event,session,segment,file,epoch,records\n")
+            self._recover(last)
+        except Exception:
+            pass  # a damaged old log must not stop us from logging
+        return True
+
+    def _manifest_tail(self) -> str:
+        # last line of the manifest, "" if there is none
+        try:
+            with open(self._manifest, "rb") as f:
+                size = f.seek(0, 2)
+                f.seek(max(0, size - 128))
+                tail = f.read()
+        except OSError:
+            return ""
+        return tail.decode().strip().split("\n")[-1]
+
+    def _manifest_line(self, event, name, epoch, records) -> None:
+        with open(self._manifest, "a") as f:
+            f.write("%s,%d,%d,%s,%d,%d\n" % (
+                event, self._session_id, self._segment, name, epoch, records))
+
+    def _recover(self, last) -> None:
+        """
+        The segment left open by a power cut is the last one in the manifest.
+        Journaled: find its last valid batch, write the real count into the
+        header and close it in the manifest.
         """
-        Create a new CSV file and open it for append.
+        fields = last.split(",")
+        if len(fields) < 6 or fields[0] not in ("open", "resume", "close"):
+            return
+        self._session_id = int(fields[1])
+        if fields[0] == "close" or not self._journal:
+            return
+        self._segment = int(fields[2])
+        found = self._recover_file("%s/%s" % (self.mount_point, fields[3]))
+        if found:
+            self._manifest_line("close", fields[3], found[1], found[0])
+
+    def _recover_file(self, path):
+        # -> (record count, epoch of last record), or None
+        buf = self._journal.buf  # idle at mount time
+        with open(path, "r+b") as f:
+            if f.readinto(buf) != BATCH_SIZE:
+                return
+            info = parse_header(buf)
+            if not info or info[0] not in (JOURNAL_VERSION, DELTA_VERSION) or info[4]:
+                return  # not journaled, or closed cleanly
+            record_size = info[2]
+
+            def batch(i):
+                # an empty batch has no first record to take seq/epoch from
+                f.seek(BATCH_SIZE * (i + 1))
+                if f.readinto(buf) != BATCH_SIZE:
+                    return -1
+                n = check_batch(buf, key, i)
+                return n if n > 0 else -1
+
+            f.seek(BATCH_SIZE)
+            if f.readinto(buf) != BATCH_SIZE:
+                return
+            key = struct.unpack_from("<I", buf, 4)[0]
+            if batch(0) < 0:
+                return None
+
+            # batches are written in order -> the valid ones form a prefix
+            lo = 1
+            hi = os.stat(path)[6] // BATCH_SIZE - 1
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if batch(mid) >= 0:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            nbytes = batch(lo - 1)
+            # first record of the last batch carries its seq number
+            if info[0] == DELTA_VERSION:
+                first, n, last_epoch = DeltaEncoder(info[1]).scan_batch(buf, nbytes)
+                count = first + n
+            else:
+                count = struct.unpack_from("<I", buf, 16)[0] + nbytes // record_size
+                last_epoch = struct.unpack_from("<I", buf, 16 + nbytes - record_size + 4)[0]
+
+            f.seek(COUNT_OFFSET)
+            f.write(struct.pack("<I", count))
+        return count, last_epoch
+
+    def start_new(self, start_utc_iso: str, epoch: int = 0) -> str | None:
+        """
+        Start a session (or resume the last one) and open its first segment.
         Returns path if created, else None.
         """
         if not self.sd_ok:
             return None
 
-        # Example: 20251206T121200Z.csv (safe filename)
-        fn_safe = start_utc_iso.replace("-", "").replace(":", "")
-        path = "%s/%s.csv" % (self.mount_point, fn_safe)
+        if (self._session_name is not None and self.resume_ms
+                and time.ticks_diff(time.ticks_ms(), self._stopped_ms) < self.resume_ms):
+            if self._stopped_path:
+                try:
+                    return self._reopen_segment(self._stopped_path, epoch)
+                except OSError:
+                    pass    # continue the session in a new segment instead
+            self._segment += 1
+        else:
+            self._session_id += 1
+            self._segment = 0
+            # Example: 20251206T121200Z (safe filename)
+            self._session_name = start_utc_iso.replace("-", "").replace(":", "")
+        return self._open_segment(epoch)
+
+    def _open_segment(self, epoch) -> str:
+        name = "%s_%03d.%s" % (self._session_name, self._segment, "bin" if self.binary else "csv")
+        path = "%s/%s" % (self.mount_point, name)
 
         # Write header
-        with open(path, "w") as f:
-            f.write("utc_iso,temp_c,humidity_percent\n")
+        if self.binary:
+            header = self._format.header(version=self._version)
+            if self._journal:
+                self._journal.reset((epoch ^ time.ticks_us()) & 0xFFFFFFFF or 1)
+                self._batch_written = 0
+            if self._delta:
+                self._delta.keyframe = True
+        else:
+            header = self._csv_header
+        self._file = self._open_log(path)
+        self._file.write(header)
+
+        self._path = path
+        self._seq = 0
+        self._file_pos = len(header)
+        self._since_sync = 0
+        self._last_sync_ms = time.ticks_ms()
+        self._seg_start_ms = self._last_sync_ms
+        self._last_epoch = epoch
+        self._manifest_line("open", name, epoch, 0)
+        return path
 
-        self._file = open(path, "a")
+    def _reopen_segment(self, path, epoch) -> str:
+        # the journal batch and delta coder state are still as stop() left them
+        f = open(path, "r+b")
+        if self.binary:
+            # open again: "read to EOF" (and recover) until the next clean close
+            f.seek(COUNT_OFFSET)
+            f.write(struct.pack("<I", 0))
+            f.flush()
+        f.seek(self._file_pos)
+        self._file = f
         self._path = path
+        self._since_sync = 0
+        self._last_sync_ms = time.ticks_ms()
+        self._manifest_line("resume", path[len(self.mount_point) + 1:], epoch, self._seq)
         return path
 
-    def write_row(self, utc_iso: str, temp_c: float, rh_percent: float) -> None:
+    def _take_slot(self):
+        # oldest unused file from prepare_card.py, if any
+        d = self.mount_point + "/prealloc"
+        try:
+            names = sorted(os.listdir(d))
+        except OSError:
+            return None
+        return "%s/%s" % (d, names[0]) if names else None
+
+    def _open_log(self, path):
+        # csv has no length field, so it is never preallocated (the tail would be garbage)
+        self._alloc_end = 0
+        if not (self.binary and self.prealloc_bytes):
+            return open(path, "wb")
+
+        slot = self._take_slot()
+        if slot:
+            os.rename(slot, path)
+            f = open(path, "r+b")
+            self._alloc_end = os.stat(path)[6]
+        else:
+            f = open(path, "wb")
+            # seeking past EOF makes FatFs allocate the whole cluster chain now
+            f.seek(self.prealloc_bytes - 1)
+            f.write(b"\0")
+            # commit start cluster + size now: sync() skips the flush inside
+            # the preallocated space, and recovery needs the file's full size
+            f.flush()
+            f.seek(0)
+            self._alloc_end = self.prealloc_bytes
+        return f
+
+    @property
+    def bytes_buffered(self) -> int:
+        return self._ring.used
+
+    def _put(self, data) -> None:
+        if len(data) > self._ring.free():
+            self._write_sectors()
+        self._ring.put(data)
+
+    def _write_batch(self, advance) -> None:
+        """
+        Writes the open batch, sealed with what it holds so far, to its sector
+        at _file_pos (again, if a sync already wrote part of it). advance=True
+        once it is full: the next batch goes into the next sector.
+        """
+        j = self._journal
+        if not j.empty() and j.fill > self._batch_written:
+            t0 = time.ticks_us()
+            j.seal()
+            self._file.seek(self._file_pos)
+            self._file.write(j.buf)
+            self._flushed(t0, j.fill - self._batch_written)
+            self._batch_written = j.fill
+        if advance and not j.empty():
+            self._file_pos += BATCH_SIZE
+            self._batch_written = 0
+            j.next()
+            if self._delta:
+                self._delta.keyframe = True
+
+    def _append(self, data) -> None:
+        self._put(data)
+        self._row_done()
+
+    def _row_done(self) -> None:
+        self._since_sync += 1
+        now = time.ticks_ms()
+
+        if (self._since_sync >= self.flush_records
+                or time.ticks_diff(now, self._last_sync_ms) >= self.flush_ms):
+            self.sync()
+
+        if ((self.segment_bytes and self._file_pos + self._ring.used >= self.segment_bytes)
+                or (self.segment_s and time.ticks_diff(now, self._seg_start_ms) >= self.segment_s * 1000)):
+            self._close_segment()
+            self._segment += 1
+            self._open_segment(self._last_epoch)
+
+    def _flushed(self, t0, n) -> None:
+        # counters for one write of n new bytes that started at ticks_us t0
+        self.bytes_written += n
+        self.flush_count += 1
+        self.last_flush_us = time.ticks_diff(time.ticks_us(), t0)
+        if self.last_flush_us > self.max_flush_us:
+            self.max_flush_us = self.last_flush_us
+
+    def _drain(self, n) -> None:
+        t0 = time.ticks_us()
+        self._ring.drain(self._file, n)
+        self._file_pos += n
+        self._flushed(t0, n)
+
+    def _write_sectors(self) -> None:
+        # only whole sectors, aligned to the file position, so FatFs can pass
+        # them straight to the block device without a read-modify-write
+        n = (self._file_pos + self._ring.used) // SECTOR_SIZE * SECTOR_SIZE - self._file_pos
+        if n > 0:
+            self._drain(n)
+
+    def sync(self) -> None:
+        """
+        Push everything buffered to the card and commit it (FAT + directory entry).
+        """
+        if self._file:
+            if self._journal:
+                self._write_batch(False)
+            elif self._ring.used:
+                self._drain(self._ring.used)
+            # batches inside the preallocated space are recoverable without
+            # a committed directory entry
+            if not (self._journal and self._file_pos + BATCH_SIZE <= self._alloc_end):
+                self._file.flush()
+            else:
+                # still get sectors held back by the block device layers
+                # (drivers/storage_cache.py) onto the card
+                self._dev.ioctl(3, 0)
+        self._since_sync = 0
+        self._last_sync_ms = time.ticks_ms()
+
+    def write_row(self, utc_iso: str, values, epoch: int = 0) -> None:
+        """
+        Csv mode: one row from the same raw ticks write_record() takes.
+        """
         if not self._file:
             return
-        self._file.write("%s,%.2f,%.2f\n" % (utc_iso, temp_c, rh_percent))
-        self._file.flush()
+        self._seq += 1
+        self._last_epoch = epoch
+        mask = values[self._csv_mask] if self._csv_mask >= 0 else 0xFFFF
+        row = utc_iso
+        for i, conv in self._csv_columns:
+            if not (mask >> i) & 1:
+                row += ","
+            elif conv:
+                row += ",%.2f" % conv(values[i])
+            else:
+                row += ",%d" % values[i]
+        self._append((row + "\n").encode())
+
+    def write_record(self, epoch: int, ticks_ms: int, values) -> None:
+        """
+        Binary mode: one record of raw sensor ticks (one u16 per channel).
+        """
+        if not self._file:
+            return
+        self._last_epoch = epoch
+        j = self._journal
+        if self._delta:
+            if BATCH_SIZE - j.fill < self._delta.max_record:
+                self._write_batch(True)
+            j.fill = self._delta.encode_into(j.buf, j.fill, self._seq, epoch, ticks_ms, values)
+            self._seq += 1
+            self._row_done()
+            return
+        if j:
+            # packed straight into the batch sector, no copy
+            self._format.pack_into(j.buf, j.fill, self._seq, epoch, ticks_ms, values)
+            self._seq += 1
+            j.fill += self._format.record_size
+            if j.full():
+                self._write_batch(True)
+            self._row_done()
+            return
+        self._format.pack_into(self._record, 0, self._seq, epoch, ticks_ms, values)
+        self._seq += 1
+        self._append(self._record)
 
     def stop(self) -> None:
+        if self._file:
+            self._stopped_path = self._path
+            self._close_segment()
+            self._stopped_ms = time.ticks_ms()
+
+    def _close_segment(self) -> None:
         if self._file:
             try:
-                self._file.flush()
+                self.sync()
             except Exception:
                 pass
+            if self.binary:
+                try:
+                    self._file.seek(COUNT_OFFSET)
+                    self._file.write(struct.pack("<I", self._seq))
+                except Exception:
+                    pass
             try:
                 self._file.close()
             except Exception:
                 pass
+            try:
+                self._manifest_line("close", self._path[len(self.mount_point) + 1:],
+                                    self._last_epoch, self._seq)
+            except Exception:
+                pass
         self._file = None
         self._path = None
+        self._ring.clear()
 
     @property
     def current_path(self):
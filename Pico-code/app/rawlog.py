@@ -0,0 +1,266 @@
+# app/rawlog.py
+# Raw block logging: records stream into a reserved, contiguous region of the card
+# with open-ended CMD25 writes - no VfsFat, no FAT/directory updates.
+# data-analysis/rawcard.py pulls sessions back out of a card image.
+import struct
+import time
+
+from app.logformat import RecordFormat, SHT31_CHANNELS
+
+BLOCK_SIZE = 512
+
+# Superblock (first block of the region):
+#   magic, version, session count, region start, region blocks
+#   then one entry per session: start block, block count, start epoch, key
+# block count 0 = session was never closed (power cut), mount() recovers it
+SB_MAGIC = b"BRSB"
+SB_VERSION = 1
+_SB_FMT = "<4sHHII"
+_SB_SIZE = 16
+_SESSION_FMT = "<IIII"
+_SESSION_SIZE = 16
+MAX_SESSIONS = (BLOCK_SIZE - _SB_SIZE) // _SESSION_SIZE
+
+# Every data block: session key, block seq within session, payload bytes, reserved.
+# Payloads of one session concatenated = a regular .bin log (header + records).
+_BLOCK_FMT = "<IIHH"
+BLOCK_HEADER_SIZE = 12
+
+
+class RawBlockLogger:
+    """
+    Same interface as SdLogger (binary records only), but writes straight into
+    blocks [start_block, start_block + nblocks) of the card.
+    The region must lie outside every partition; mount() refuses otherwise.
+    """
+    binary = True
+
+    def __init__(self, start_block, nblocks, channels=SHT31_CHANNELS,
+                 flush_records=64, flush_ms=5000, erase_hint=2048):
+        self.start_block = start_block
+        self.nblocks = nblocks
+        self.flush_records = flush_records
+        self.flush_ms = flush_ms
+        self.erase_hint = erase_hint
+        self.sd_ok = False
+
+        self._sd = None
+        self._sb = bytearray(BLOCK_SIZE)
+        self._sessions = 0
+        self._next_block = start_block + 1
+
+        self._format = RecordFormat(channels)
+        self._record = bytearray(self._format.record_size)
+        self._block = bytearray(BLOCK_SIZE)
+        self._block_mv = memoryview(self._block)
+        self._fill = BLOCK_HEADER_SIZE
+        self._session = -1
+        self._key = 0
+        self._block_seq = 0
+        self._seq = 0
+        self._since_sync = 0
+        self._last_sync_ms = time.ticks_ms()
+
+        # counters
+        self.bytes_written = 0
+        self.flush_count = 0
+        self.last_flush_us = 0
+        self.max_flush_us = 0
+
+    # --- superblock ---
+
+    def _entry(self, i):
+        return struct.unpack_from(_SESSION_FMT, self._sb, _SB_SIZE + i * _SESSION_SIZE)
+
+    def _set_entry(self, i, start, count, epoch, key):
+        struct.pack_into(_SESSION_FMT, self._sb, _SB_SIZE + i * _SESSION_SIZE,
+                         start, count, epoch, key)
+
+    def _write_superblock(self):
+        struct.pack_into(_SB_FMT, self._sb, 0, SB_MAGIC, SB_VERSION,
+                         self._sessions, self.start_block, self.nblocks)
+        self._sd.writeblocks(self.start_block, self._sb)
+
+    def _check_partitions(self):
+        # refuse to scribble over a filesystem
+        mbr = self._block
+        self._sd.readblocks(0, mbr)
+        if mbr[510] != 0x55 or mbr[511] != 0xAA:
+            return
+        if mbr[0] in (0xEB, 0xE9):
+            raise OSError("card has no partition table (FAT spans whole card)")
+        end = self.start_block + self.nblocks
+        for i in range(4):
+            off = 446 + 16 * i
+            if not mbr[off + 4]:
+                continue
+            lba, count = struct.unpack_from("<II", mbr, off + 8)
+            if lba < end and self.start_block < lba + count:
+                raise OSError("raw log region overlaps partition %d" % (i + 1))
+
+    def _valid_block(self, start, key, i):
+        self._sd.readblocks(start + i, self._block)
+        k, seq, n, _ = struct.unpack_from(_BLOCK_FMT, self._block)
+        return k == key and seq == i
+
+    def _recover(self):
+        # last session not closed cleanly: blocks are written in order, so the
+        # valid ones form a prefix -> binary search its length
+        i = self._sessions - 1
+        start, count, epoch, key = self._entry(i)
+        if count:
+            return
+        lo = 0
+        hi = self.start_block + self.nblocks - start
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._valid_block(start, key, mid):
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo:
+            self._set_entry(i, start, lo, epoch, key)
+        else:
+            self._sessions = i  # nothing written, drop it
+        self._write_superblock()
+
+    def mount(self, sdcard_block_device) -> bool:
+        """
+        Read (or create) the superblock and close any session left open by a power cut.
+        Returns True if the region is usable.
+        """
+        try:
+            self._sd = sdcard_block_device
+            self._check_partitions()
+            self._sd.readblocks(self.start_block, self._sb)
+            magic, version, sessions, start, nblocks = struct.unpack_from(_SB_FMT, self._sb)
+            if magic != SB_MAGIC or start != self.start_block or nblocks != self.nblocks:
+                # first use of this region
+                for i in range(BLOCK_SIZE):
+                    self._sb[i] = 0
+                self._sessions = 0
+                self._write_superblock()
+            else:
+                self._sessions = sessions
+                if sessions:
+                    self._recover()
+
+            self._next_block = self.start_block + 1
+            if self._sessions:
+                start, count, epoch, key = self._entry(self._sessions - 1)
+                self._next_block = start + count
+            self.sd_ok = True
+        except Exception:
+            self.sd_ok = False
+        return self.sd_ok
+
+    # --- session lifecycle ---
+
+    def start_new(self, start_utc_iso: str, epoch: int = 0) -> str | None:
+        """
+        Register a session in the superblock and open the CMD25 stream.
+        Returns a "raw:<n>" pseudo path, else None.
+        """
+        if not self.sd_ok:
+            return None
+        remaining = self.start_block + self.nblocks - self._next_block
+        if self._sessions >= MAX_SESSIONS or remaining <= 0:
+            raise OSError("raw log region full")
+
+        self._session = self._sessions
+        self._key = (epoch ^ time.ticks_us() ^ (self._next_block << 4)) & 0xFFFFFFFF or 1
+        self._sessions += 1
+        self._set_entry(self._session, self._next_block, 0, epoch, self._key)
+        self._write_superblock()
+
+        self._sd.stream_begin(self._next_block, min(self.erase_hint, remaining))
+        self._block_seq = 0
+        self._fill = BLOCK_HEADER_SIZE
+        self._seq = 0
+        self._since_sync = 0
+        self._last_sync_ms = time.ticks_ms()
+        self._put(self._format.header())
+        return self.current_path
+
+    def _emit(self) -> None:
+        # send the current block (even if partially filled)
+        if self._fill == BLOCK_HEADER_SIZE:
+            return
+        if self._next_block + self._block_seq >= self.start_block + self.nblocks:
+            raise OSError("raw log region full")
+        struct.pack_into(_BLOCK_FMT, self._block, 0, self._key, self._block_seq,
+                         self._fill - BLOCK_HEADER_SIZE, 0)
+        t0 = time.ticks_us()
+        self._sd.stream_write(self._block)
+        self.last_flush_us = time.ticks_diff(time.ticks_us(), t0)
+        if self.last_flush_us > self.max_flush_us:
+            self.max_flush_us = self.last_flush_us
+        self.flush_count += 1
+        self.bytes_written += BLOCK_SIZE
+        self._block_seq += 1
+        self._fill = BLOCK_HEADER_SIZE
+
+    def _put(self, data) -> None:
+        src = memoryview(data)
+        n = len(data)
+        i = 0
+        while i < n:
+            k = min(n - i, BLOCK_SIZE - self._fill)
+            self._block_mv[self._fill:self._fill + k] = src[i:i + k]
+            self._fill += k
+            i += k
+            if self._fill == BLOCK_SIZE:
+                self._emit()
+
+    @property
+    def bytes_buffered(self) -> int:
+        return self._fill - BLOCK_HEADER_SIZE
+
+    def sync(self) -> None:
+        """
+        Send the partially filled block now. Raw blocks can't be appended to later,
+        so the next data starts a fresh block.
+        """
+        if self._session >= 0:
+            self._emit()
+        self._since_sync = 0
+        self._last_sync_ms = time.ticks_ms()
+
+    def write_record(self, epoch: int, ticks_ms: int, values) -> None:
+        if self._session < 0:
+            return
+        self._format.pack_into(self._record, 0, self._seq, epoch, ticks_ms, values)
+        self._seq += 1
+        self._put(self._record)
+        self._since_sync += 1
+
+        if (self._since_sync >= self.flush_records
+                or time.ticks_diff(time.ticks_ms(), self._last_sync_ms) >= self.flush_ms):
+            self.sync()
+
+    def stop(self) -> None:
+        if self._session < 0:
+            return
+        try:
+            self.sync()
+        except Exception:
+            pass
+        start, count, epoch, key = self._entry(self._session)
+        self._next_block = start + self._block_seq
+        self._session = -1
+        try:
+            self._sd.stream_end()
+            if self._block_seq:
+                self._set_entry(self._sessions - 1, start, self._block_seq, epoch, key)
+            else:
+                self._sessions -= 1
+            self._write_superblock()
+        except Exception:
+            # superblock stays "open" -> recovered on next mount
+            pass
+
+    @property
+    def current_path(self):
+        if self._session < 0:
+            return None
+        return "raw:%d" % self._session
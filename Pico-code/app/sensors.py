@@ -0,0 +1,134 @@
+# app/sensors.py
+# Sensors sharing the I2C bus, sampled together: all conversions are started
+# back to back, then all results collected in one pass, so their conversion
+# times overlap instead of adding up.
+import time
+
+from app.logformat import MASK_CHANNEL
+
+# per sensor, for the sample in flight
+_IDLE = 0
+_BUSY = 1
+_DONE = 2
+_FAILED = 3
+
+
+class SensorRegistry:
+    """
+    Sensors with the start_measurement()/collect() interface of
+    drivers/sensor_sht31.py, and the log channels each one fills.
+
+        reg = SensorRegistry()
+        reg.add("sht31", SHT31(i2c, 0x44), sht31_channels(), display=True)
+        reg.add("sht31_45", SHT31(i2c, 0x45), sht31_channels("_45"), display=True)
+        reg.start_all()
+        while not reg.collect_all():
+            ...                         # other work
+        reg.values                      # raw ticks, one per channel
+
+    channels (all sensors, in registration order, then MASK_CHANNEL) is the
+    log schema. values is one preallocated list refilled every sample, copy
+    it to keep it; its last item is the validity mask. A sensor that fails
+    or hasn't delivered after timeout_ms doesn't hold up the others: its
+    mask bits stay clear (its values keep the last reading) and
+    on_error(name, exc) is called.
+
+    display=True: the sensor's first two channels are (t_ticks, rh_ticks)
+    the screen and the csv log can show; see display_offset().
+    """
+    def __init__(self, timeout_ms=500, on_error=None):
+        self.timeout_ms = timeout_ms
+        self.on_error = on_error
+        self.channels = ()
+        self.values = []
+        self._names = []
+        self._sensors = []
+        self._offsets = []      # first channel of each sensor
+        self._widths = []
+        self._display = []
+        self._state = bytearray()
+        self._started_ms = 0
+        self.ok = 0             # sensors that delivered the last sample
+        self.failures = 0
+
+    def __len__(self):
+        return len(self._sensors)
+
+    def add(self, name, sensor, channels, display=False) -> None:
+        channels = tuple(channels)
+        data = self.channels[:-1]
+        if len(data) + len(channels) > 16:
+            raise ValueError("more than 16 channels")
+        self._names.append(name)
+        self._sensors.append(sensor)
+        self._offsets.append(len(data))
+        self._widths.append(len(channels))
+        self._display.append(display)
+        self._state.append(_IDLE)
+        self.channels = data + channels + (MASK_CHANNEL,)
+        self.values = [0] * len(self.channels)
+
+    def _fail(self, i, e):
+        self._state[i] = _FAILED
+        self.failures += 1
+        if self.on_error:
+            self.on_error(self._names[i], e)
+
+    def start_all(self) -> bool:
+        """
+        Starts every conversion. True if at least one is now running.
+        """
+        self._started_ms = time.ticks_ms()
+        self.ok = 0
+        if self.values:
+            self.values[-1] = 0
+        busy = False
+        for i in range(len(self._sensors)):
+            try:
+                self._sensors[i].start_measurement()
+            except Exception as e:
+                self._fail(i, e)
+                continue
+            self._state[i] = _BUSY
+            busy = True
+        return busy
+
+    def collect_all(self) -> bool:
+        """
+        Collects what is ready. True once no sensor is still converting.
+        """
+        late = time.ticks_diff(time.ticks_ms(), self._started_ms) >= self.timeout_ms
+        pending = False
+        values = self.values
+        for i in range(len(self._sensors)):
+            if self._state[i] != _BUSY:
+                continue
+            try:
+                raw = self._sensors[i].collect()
+            except Exception as e:
+                self._fail(i, e)
+                continue
+            if raw is None:
+                if late:
+                    self._fail(i, OSError("no result"))
+                else:
+                    pending = True
+                continue
+            o = self._offsets[i]
+            w = self._widths[i]
+            for k in range(w):
+                values[o + k] = raw[k]
+            values[-1] |= ((1 << w) - 1) << o
+            self._state[i] = _DONE
+            self.ok += 1
+        return not pending
+
+    def display_offset(self) -> int:
+        """
+        First channel of the first display sensor that delivered the last
+        sample, -1 if none did.
+        """
+        for i in range(len(self._sensors)):
+            if self._display[i] and self._state[i] == _DONE:
+                return self._offsets[i]
+        return -1
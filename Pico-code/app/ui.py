@@ -1,24 +1,223 @@
+import time
+
+from app.layout import Glyphs, Layout, Sparkline
+
+# panel power states of the idle policy
+_AWAKE = 2
+_DIM = 1
+_OFF = 0
+
+
 class Ui:
     """
     OLED rendering logic only.
+
+    Keeps what is on the panel (screen + the fields as displayed). A show_*
+    call whose fields match that is a no-op; otherwise the frame is drawn,
+    at most max_fps times a second. A frame held back by that cap is drawn
+    by a later show_* or tick() call.
+
+    The OFF/ON screens are app/layout.py layouts: labels come from a
+    background frame, values from cached glyphs (16x16 readings with
+    large_digits=True).
+
+    Idle policy: dim_after_s without wake() the contrast drops to
+    dim_contrast, off_after_s without it the panel is powered off and
+    nothing is drawn (the newest frame waits for the next wake()). A new
+    error screen wakes it too. 0 disables either step.
     """
-    def __init__(self, oled):
+    def __init__(self, oled, max_fps=5, large_digits=False, history_decimate=0,
+                 dim_after_s=0, off_after_s=0, dim_contrast=0x10):
         self.oled = oled
+        self._build_layouts(large_digits)
 
-    def show_off(self, utc_iso: str):
-        self.oled.fill(0)
-        self.oled.text("Experiment OFF", 0, 0)
-        self.oled.text(utc_iso[:10], 0, 16)
-        self.oled.text(utc_iso[11:19] + "Z", 0, 26)
-        self.oled.text("Switch the switch", 0, 44)
-        self.oled.text("to turn ON", 0, 54)
+        self.dim_after_ms = dim_after_s * 1000
+        self.off_after_ms = off_after_s * 1000
+        self.dim_contrast = dim_contrast
+        self._power = _AWAKE
+        self._last_wake_ms = time.ticks_ms()
+        self._wake = False
+
+        # temperature/humidity history right of the readings (small digits only)
+        self._t_hist = None
+        self._rh_hist = None
+        self._hist_rev = 0
+        if history_decimate and not large_digits:
+            self._t_hist = Sparkline(40, 20, -10, 30, history_decimate)
+            self._rh_hist = Sparkline(40, 20, 0, 100, history_decimate)
+        self.min_frame_ms = 1000 // max_fps if max_fps else 0
+        self._last_frame_ms = time.ticks_add(time.ticks_ms(), -self.min_frame_ms)
+
+        # on the panel
+        self._screen = None
+        self._fields = None
+        # requested but not drawn yet (frame rate cap)
+        self._want_screen = None
+        self._want_fields = None
+
+        self.frames = 0
+        self.unchanged = 0
+
+    def _build_layouts(self, large):
+        w = self.oled.width
+        h = self.oled.height
+        small = Glyphs()
+
+        off = Layout(w, h, small)
+        off.label("Experiment OFF", 0, 0)
+        off.field(0, 2)                 # date
+        off.field(0, 3)                 # time
+        off.label("Z", 64, 3)
+        off.label("Switch the switch", 0, 5)
+        off.label("to turn ON", 0, 6)
+
+        on = Layout(w, h, small, Glyphs(scale=2) if large else None)
+        on.label("Borealis-1", 0, 0)
+        if large:
+            # "T"/"H" + up to 5 characters at 16 px, unit in the last column
+            on.label("T", 0, 2)
+            on.field(16, 2, large=True)
+            on.label("C", 112, 3)
+            on.label("H", 0, 4)
+            on.field(16, 4, large=True)
+            on.label("%", 112, 5)
+            on.field(0, 7)              # date
+            on.field(88, 7)             # hh:mm, no room for seconds
+        else:
+            on.label("T:", 0, 2)
+            on.field(24, 2)
+            on.label("C", 72, 2)
+            on.label("H:", 0, 3)
+            on.field(24, 3)
+            on.label("%", 72, 3)
+            on.field(0, 5)              # date
+            on.field(0, 6)              # time
+            on.label("Z", 64, 6)
+        self._off = off
+        self._on = on
+        self._large = large
+
+    @property
+    def panel_off(self) -> bool:
+        # powered off by the idle policy and staying so (no wake() pending):
+        # frames requested now wait for the next wake()
+        return self._power == _OFF and not self._wake
+
+    def due(self) -> bool:
+        # whether tick() has anything to do (frame or idle step); with the
+        # panel off only a wake() is, a waiting frame is drawn after it
+        if self._wake:
+            return True
+        if self._power == _OFF:
+            return False
+        if self._want_screen is not None:
+            return True
+        idle = time.ticks_diff(time.ticks_ms(), self._last_wake_ms)
+        return ((self._power == _AWAKE and self.dim_after_ms and idle >= self.dim_after_ms)
+                or (self.off_after_ms and idle >= self.off_after_ms))
+
+    def wake(self) -> None:
+        """
+        User activity. Only sets flags (no bus traffic), so it is safe to
+        call from the other core; tick() does the rest.
+        """
+        self._last_wake_ms = time.ticks_ms()
+        self._wake = True
+
+    def _power_policy(self, now):
+        if self._wake:
+            self._wake = False
+            if self._power != _AWAKE:
+                if self._power == _OFF:
+                    self.oled.poweron()
+                self.oled.contrast(0xFF)
+                self._power = _AWAKE
+            return
+        if self._power == _OFF:
+            return
+        idle = time.ticks_diff(now, self._last_wake_ms)
+        if self.off_after_ms and idle >= self.off_after_ms:
+            self.oled.poweroff()
+            self._power = _OFF
+        elif self._power == _AWAKE and self.dim_after_ms and idle >= self.dim_after_ms:
+            self.oled.contrast(self.dim_contrast)
+            self._power = _DIM
+
+    def _request(self, screen, fields) -> bool:
+        if screen == self._screen and fields == self._fields:
+            self._want_screen = None
+            self.unchanged += 1
+            return False
+        if screen == "error":
+            self.wake()
+        self._want_screen = screen
+        self._want_fields = fields
+        return self.tick()
+
+    def tick(self) -> bool:
+        """
+        Draws a held-back frame once the frame interval has passed.
+        True if something was sent to the panel.
+        """
+        now = time.ticks_ms()
+        self._power_policy(now)
+        screen = self._want_screen
+        if screen is None or self._power == _OFF:
+            return False
+        if time.ticks_diff(now, self._last_frame_ms) < self.min_frame_ms:
+            return False
+        fields = self._want_fields
+        self._want_screen = None
+        self._want_fields = None
+
+        if screen == "off":
+            self._draw_off(*fields)
+        elif screen == "on":
+            self._draw_on(*fields)
+        else:
+            self._draw_error(*fields)
         self.oled.show()
 
-    def show_on(self, temp_c: float, rh: float, utc_iso: str):
+        self._screen = screen
+        self._fields = fields
+        self._last_frame_ms = now
+        self.frames += 1
+        return True
+
+    def show_off(self, utc_iso: str) -> bool:
+        return self._request("off", (utc_iso[:10], utc_iso[11:19]))
+
+    def show_on(self, temp_c: float, rh: float, utc_iso: str) -> bool:
+        """
+        Once per sample: the readings also feed the history graphs.
+        """
+        if self._t_hist:
+            # either both or neither get a new point
+            self._t_hist.add(temp_c)
+            if self._rh_hist.add(rh):
+                self._hist_rev += 1
+        # large digits leave room for hh:mm only, so seconds don't count as a change
+        hms = utc_iso[11:16] if self._large else utc_iso[11:19]
+        return self._request("on", ("%.1f" % temp_c, "%.1f" % rh, utc_iso[:10], hms, self._hist_rev))
+
+    def show_error(self, level: str, where: str, etype: str, msg: str) -> bool:
+        return self._request("error", (level, where, etype, msg))
+
+    def _draw_off(self, date, hms):
+        self._off.render(self.oled.buffer, self.oled.framebuf, (date, hms))
+
+    def _draw_on(self, temp, rh, date, hms, rev):
+        fb = self.oled.framebuf
+        self._on.render(self.oled.buffer, fb, (temp, rh, date, hms))
+        if self._t_hist:
+            fb.blit(self._t_hist.fb, 88, 16)
+            fb.blit(self._rh_hist.fb, 88, 36)
+
+    def _draw_error(self, level, where, etype, msg):
         self.oled.fill(0)
-        self.oled.text("Borealis-1", 0, 0)
-        self.oled.text("T: %.1f C" % temp_c, 0, 16)
-        self.oled.text("H: %.1f %%" % rh, 0, 26)
-        self.oled.text(utc_iso[:10], 0, 38)
-        self.oled.text(utc_iso[11:19] + "Z", 0, 48)
-        self.oled.show()
+        self.oled.text("SAFE: " + level, 0, 0)
+        self.oled.text(where[:16], 0, 12)
+        self.oled.text(etype[:16], 0, 22)
+        # message wrapped over the remaining lines
+        for i in range(4):
+            self.oled.text(msg[i * 16:(i + 1) * 16], 0, 32 + i * 8)
@@ -0,0 +1,265 @@
+# app/worker.py
+# Optional dual-core mode: SD logging + OLED rendering run on core 1 so a slow
+# card or a display transfer never delays sampling on core 0.
+import _thread
+import time
+
+from app.safe_mode import LEVEL_WARNING, LEVEL_CRITICAL
+
+_KIND_SAMPLE = 0
+_KIND_ROW = 1
+_KIND_START = 2
+_KIND_STOP = 3
+_KIND_SYNC = 4
+
+
+class NullLock:
+    """
+    Stand-in for a _thread lock when everything runs on one core.
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+class RecordQueue:
+    """
+    Fixed ring of preallocated slots shared by both cores.
+    Samples are dropped (and counted) when core 1 falls behind; start/stop
+    messages wait for a free slot instead, they must never be lost.
+    """
+    def __init__(self, slots=32):
+        self._lock = _thread.allocate_lock()
+        # kind, utc_iso, epoch, ticks_ms, values
+        self._slots = [[0, "", 0, 0, None] for _ in range(slots)]
+        self._taken = None  # consumer side copy of the last values taken
+        self._head = 0
+        self._count = 0
+        self.dropped = 0
+        self.max_depth = 0
+
+    def put(self, kind, utc_iso, epoch, ticks_ms, values, block=False) -> bool:
+        n = len(self._slots)
+        while True:
+            with self._lock:
+                if self._count < n:
+                    s = self._slots[(self._head + self._count) % n]
+                    s[0] = kind
+                    s[1] = utc_iso
+                    s[2] = epoch
+                    s[3] = ticks_ms
+                    # copied into the slot's own list: sensors hand out
+                    # one reused list per read
+                    if values is not None:
+                        dst = s[4]
+                        if dst is None or len(dst) != len(values):
+                            s[4] = list(values)
+                        else:
+                            for i in range(len(values)):
+                                dst[i] = values[i]
+                    self._count += 1
+                    if self._count > self.max_depth:
+                        self.max_depth = self._count
+                    return True
+                if not block:
+                    self.dropped += 1
+                    return False
+            time.sleep_ms(1)
+
+    def get_into(self, out) -> bool:
+        """
+        Copies the oldest slot into out (a 5-item list). False if empty.
+        Values land in out's own list, so the slot can be refilled at once.
+        """
+        with self._lock:
+            if not self._count:
+                return False
+            s = self._slots[self._head]
+            for i in range(4):
+                out[i] = s[i]
+            v = s[4]
+            if s[0] not in (_KIND_SAMPLE, _KIND_ROW) or v is None:
+                out[4] = None
+            else:
+                dst = self._taken
+                if dst is None or len(dst) != len(v):
+                    dst = self._taken = list(v)
+                else:
+                    for i in range(len(v)):
+                        dst[i] = v[i]
+                out[4] = dst
+            s[1] = ""
+            self._head = (self._head + 1) % len(self._slots)
+            self._count -= 1
+            return True
+
+
+class Mailbox:
+    """
+    Latest-wins slot for screen updates: core 1 only ever draws the newest
+    request; one replaced before it was drawn counts as an overrun.
+    """
+    def __init__(self):
+        self._lock = _thread.allocate_lock()
+        self._msg = [None, None, None, None, None]
+        self._fresh = False
+        self.overruns = 0
+
+    def post(self, name, a=None, b=None, c=None, d=None) -> None:
+        with self._lock:
+            if self._fresh:
+                self.overruns += 1
+            m = self._msg
+            m[0] = name
+            m[1] = a
+            m[2] = b
+            m[3] = c
+            m[4] = d
+            self._fresh = True
+
+    def take_into(self, out) -> bool:
+        with self._lock:
+            if not self._fresh:
+                return False
+            for i in range(5):
+                out[i] = self._msg[i]
+            self._fresh = False
+            return True
+
+
+class LoggerProxy:
+    """
+    Looks like SdLogger/RawBlockLogger to the controller, but only queues work for core 1.
+    """
+    def __init__(self, logger, queue):
+        self.logger = logger
+        self.queue = queue
+        self.binary = logger.binary
+
+    def start_new(self, start_utc_iso, epoch=0):
+        self.queue.put(_KIND_START, start_utc_iso, epoch, 0, None, block=True)
+
+    def stop(self):
+        self.queue.put(_KIND_STOP, "", 0, 0, None, block=True)
+
+    def sync(self):
+        self.queue.put(_KIND_SYNC, "", 0, 0, None, block=True)
+
+    def write_record(self, epoch, ticks_ms, values):
+        self.queue.put(_KIND_SAMPLE, "", epoch, ticks_ms, values)
+
+    def write_row(self, utc_iso, values, epoch=0):
+        self.queue.put(_KIND_ROW, utc_iso, epoch, 0, values)
+
+    @property
+    def current_path(self):
+        return self.logger.current_path
+
+
+class UiProxy:
+    """
+    Looks like Ui to the controller; the newest screen is drawn by core 1.
+    """
+    def __init__(self, mailbox, ui):
+        self.mailbox = mailbox
+        self.ui = ui
+
+    def show_off(self, utc_iso):
+        self.mailbox.post("show_off", utc_iso)
+
+    def show_on(self, temp_c, rh, utc_iso):
+        self.mailbox.post("show_on", temp_c, rh, utc_iso)
+
+    def show_error(self, level, where, etype, msg):
+        self.mailbox.post("show_error", level, where, etype, msg)
+
+    def tick(self):
+        # held-back frames and idle steps are handled by core 1
+        return False
+
+    def wake(self):
+        # only flags, no bus traffic
+        self.ui.wake()
+
+    @property
+    def panel_off(self):
+        return self.ui.panel_off
+
+
+class Core1Worker:
+    """
+    Owns the real logger and Ui once started. The controller swaps its
+    sd_logger/ui for the proxies, so its code paths stay the same.
+    bus_lock guards the I2C bus the OLED shares with the sensor and RTC.
+    """
+    def __init__(self, app, slots=32):
+        self.app = app
+        self.bus_lock = _thread.allocate_lock()
+        self.queue = RecordQueue(slots)
+        self.mailbox = Mailbox()
+        self.logger = app.sd_logger
+        self.ui = app.ui
+        self._item = [0, "", 0, 0, None]
+        self._screen = [None, None, None, None, None]
+
+    def start(self):
+        _thread.start_new_thread(self._loop, ())
+        self.app.sd_logger = LoggerProxy(self.logger, self.queue)
+        if self.ui:
+            self.app.ui = UiProxy(self.mailbox, self.ui)
+
+    def _log(self):
+        it = self._item
+        kind = it[0]
+        try:
+            if kind == _KIND_SAMPLE:
+                self.logger.write_record(it[2], it[3], it[4])
+            elif kind == _KIND_ROW:
+                self.logger.write_row(it[1], it[4], it[2])
+            elif kind == _KIND_START:
+                self.logger.start_new(it[1], it[2])
+            elif kind == _KIND_STOP:
+                self.logger.stop()
+            else:
+                self.logger.sync()
+        except Exception as e:
+            where = "log_start" if kind == _KIND_START else "log_write"
+            self.app.safe.set_error(LEVEL_WARNING, where, e)
+            # same as on core 0: disable further SD attempts this session
+            if kind != _KIND_STOP:
+                self.app.sd_ok = False
+
+    def _draw(self):
+        m = self._screen
+        try:
+            with self.bus_lock:
+                if m[0] == "show_off":
+                    self.ui.show_off(m[1])
+                elif m[0] == "show_on":
+                    self.ui.show_on(m[1], m[2], m[3])
+                elif m[0] == "show_error":
+                    self.ui.show_error(m[1], m[2], m[3], m[4])
+                else:
+                    self.ui.tick()
+        except Exception as e:
+            self.app.safe.set_error(LEVEL_CRITICAL, "oled_render", e)
+            self.app.ui_ok = False
+
+    def _loop(self):
+        while True:
+            busy = False
+            # logging first: samples are the payload, the screen is cosmetic
+            while self.queue.get_into(self._item):
+                self._log()
+                busy = True
+            if self.app.ui_ok and self.mailbox.take_into(self._screen):
+                self._draw()
+                busy = True
+            elif self.app.ui_ok and self.ui.due():
+                # frame held back by the UI frame rate cap, or an idle step
+                self._screen[0] = "tick"
+                self._draw()
+            if not busy:
+                time.sleep_ms(2)
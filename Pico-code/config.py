@@ -12,7 +12,9 @@ I2C_SCL = 1
 I2C_FREQ = 400_000
 
 # SHT31
-SHT31_ADDR = 0x44
+SHT31_ADDRS = (0x44,)          # one SHT31 per address, e.g. (0x44, 0x45) for two (ADDR pin low/high); the first is shown on the OLED
+SHT31_MPS = 2                  # periodic mode, measurements/s (0.5/1/2/4/10); 0 = single shot (15 ms wait per read)
+SHT31_REPEATABILITY = "high"   # "high", "medium" or "low"
 
 # DS3231
 DS3231_ADDR = 0x68
@@ -34,8 +36,43 @@ SD_SCK = 10
 SD_MOSI = 11
 SD_MISO = 12
 SD_CS = 13
-SD_BAUDRATE = 1_000_000
+SD_BAUDRATE = 1_000_000          # after init; also the floor for automatic fallbacks
+SD_MAX_BAUDRATE = 25_000_000     # negotiate up to min(this, card's TRAN_SPEED); 0 = stay at SD_BAUDRATE
+SD_SCRATCH_BLOCK = 2047          # clock test block, in the gap before the first partition (restored after; no negotiation if it is inside one)
+SD_CRC = True                    # CMD59 CRC mode: command + data CRCs checked, bad blocks retried
+SD_RETRIES = 2                   # retries per block before dropping a clock step
+SD_CACHE_SECTORS = 8             # LRU sector cache for FAT/directory sectors (512 B each), 0 = off
+SD_COALESCE_SECTORS = 8          # adjacent single-sector writes sent as one CMD25 of up to this many, 0 = off
 SD_MOUNT_POINT = "/sd"
 
+# Logging
+LOG_FORMAT = "csv"             # "csv" (readable), "bin" (packed records) or "delta" (compressed), see app/logformat.py
+LOG_BUFFER_SECTORS = 4         # RAM ring in front of the card (x 512 bytes)
+LOG_FLUSH_RECORDS = 64         # sync to card after this many rows ...
+LOG_FLUSH_MS = 5000            # ... or this long, whichever comes first (max data lost on power cut)
+LOG_PREALLOC_BYTES = 4 * 1024 * 1024  # "bin" files are preallocated to this size (0 = grow as needed)
+LOG_JOURNAL = True             # "bin": CRC-checked sector batches, recovered on next boot after a power cut (always on with LOG_PREALLOC_BYTES)
+LOG_SEGMENT_BYTES = LOG_PREALLOC_BYTES  # start a new file after this many bytes (0 = never)
+LOG_SEGMENT_S = 3600           # ... or after this many seconds (0 = never)
+LOG_RESUME_MS = 10_000         # ON again within this long after OFF = same session (switch jitter)
+
+# Raw block logging (app/rawlog.py): "fat" = files on /sd, "raw" = stream records
+# into a reserved block range with CMD25, bypassing VfsFat (always binary records).
+# The range must lie outside the FAT partition (shrink it when preparing the card);
+# the logger refuses to start if it overlaps. Read back with data-analysis/rawcard.py
+LOG_BACKEND = "fat"
+RAW_LOG_START_BLOCK = 4_194_304  # 2 GiB into the card
+RAW_LOG_BLOCKS = 2_097_152       # 1 GiB
+
 # Sampling / UI update
 SAMPLE_INTERVAL_MS = 1000      # sensor read & log interval while ON
+UI_MAX_FPS = 5                 # OLED frames/s cap; frames are only drawn when a shown value changes
+UI_LARGE_DIGITS = False        # 16 px temperature/humidity on the ON screen (time shown as hh:mm)
+UI_HISTORY_DECIMATE = 10       # samples averaged per history graph point (40 points), 0 = no graph
+UI_DIM_AFTER_S = 60            # no switch change for this long: OLED dimmed (0 = never)
+UI_OFF_AFTER_S = 300           # ... and powered off, saves current on long flights (0 = never)
+UI_DIM_CONTRAST = 0x10
+
+# Dual core (app/worker.py): SD logging + OLED on core 1, sampling alone on core 0
+DUAL_CORE = False
+CORE1_QUEUE_SLOTS = 32         # samples buffered for core 1 before new ones are dropped
@@ -1,5 +1,6 @@
 # drivers/display_ssd1306.py
 # SSD1306 OLED driver for MicroPython (I2C + SPI variants)
+import micropython
 from micropython import const
 import framebuf
 
@@ -20,6 +21,35 @@ SET_DISP_CLK_DIV = const(0xD5)
 SET_PRECHARGE = const(0xD9)
 SET_VCOM_DESEL = const(0xDB)
 SET_CHARGE_PUMP = const(0x8D)
+SET_HSCROLL_RIGHT = const(0x26)
+SET_HSCROLL_LEFT = const(0x27)
+SET_VHSCROLL_RIGHT = const(0x29)
+SET_VHSCROLL_LEFT = const(0x2A)
+SET_SCROLL_OFF = const(0x2E)
+SET_SCROLL_ON = const(0x2F)
+SET_VSCROLL_AREA = const(0xA3)
+
+
+@micropython.viper
+def _dirty_span(buf, shadow, start: int, n: int) -> int:
+    # changed bytes of buf[start:start + n] vs shadow, as first << 8 | last
+    # (offsets into the range), -1 if none; shadow is updated as it goes
+    b = ptr8(buf)
+    s = ptr8(shadow)
+    first = -1
+    last = -1
+    i = start
+    end = start + n
+    while i < end:
+        if b[i] != s[i]:
+            if first < 0:
+                first = i
+            last = i
+            s[i] = b[i]
+        i += 1
+    if first < 0:
+        return -1
+    return ((first - start) << 8) | (last - start)
 
 
 class SSD1306:
@@ -29,14 +59,22 @@ class SSD1306:
         self.external_vcc = external_vcc
         self.pages = self.height // 8
         self.buffer = bytearray(self.pages * self.width)
+        # what the panel shows, so show() only sends what changed
+        self._shadow = bytearray(self.pages * self.width)
+        self._synced = False
+        self._scrolling = False     # panel RAM must not be written while set
+        self._mv = memoryview(self.buffer)
+        self._win = bytearray((SET_COL_ADDR, 0, 0, SET_PAGE_ADDR, 0, 0))
+        self._pair = bytearray(2)
         self.framebuf = framebuf.FrameBuffer(
             self.buffer, self.width, self.height, framebuf.MONO_VLSB
         )
         self.init_display()
 
     def init_display(self):
-        for cmd in (
+        self.write_cmds(bytes((
             SET_DISP | 0x00,                 # display off
+            SET_SCROLL_OFF,                  # may still run after a soft reset
             SET_MEM_ADDR, 0x00,              # horizontal addressing
             SET_DISP_START_LINE | 0x00,
             SET_SEG_REMAP | 0x01,            # column address 127 mapped to SEG0
@@ -52,11 +90,10 @@ class SSD1306:
             SET_NORM_INV,
             SET_CHARGE_PUMP, 0x10 if self.external_vcc else 0x14,
             SET_DISP | 0x01,                 # display on
-        ):
-            self.write_cmd(cmd)
+        )))
 
         self.fill(0)
-        self.show()
+        self.show_full()
 
     def poweroff(self):
         self.write_cmd(SET_DISP | 0x00)
@@ -65,22 +102,109 @@ class SSD1306:
         self.write_cmd(SET_DISP | 0x01)
 
     def contrast(self, contrast):
-        self.write_cmd(SET_CONTRAST)
-        self.write_cmd(contrast)
+        self._pair[0] = SET_CONTRAST
+        self._pair[1] = contrast
+        self.write_cmds(self._pair)
+
+    # --- hardware scrolling ---
+    # The panel scrolls its own RAM, no frames are sent while it runs
+    # (show() stops it first, the datasheet forbids RAM writes meanwhile).
+    # interval is the controller's 3-bit step code (0 = every 5 frames,
+    # 7 = every 2 frames, see datasheet 10.2.1).
+
+    def hscroll(self, right=True, page0=0, page1=None, interval=0):
+        """
+        Continuous horizontal scroll of pages page0..page1.
+        """
+        if page1 is None:
+            page1 = self.pages - 1
+        self.write_cmds(bytes((
+            SET_SCROLL_OFF,
+            SET_HSCROLL_RIGHT if right else SET_HSCROLL_LEFT,
+            0x00, page0, interval, page1, 0x00, 0xFF,
+            SET_SCROLL_ON,
+        )))
+        self._scrolling = True
+
+    def vscroll(self, offset=1, right=True, page0=0, page1=None, interval=0,
+                fixed_rows=0, rows=None):
+        """
+        Continuous vertical + horizontal scroll: every step moves the
+        vertical area up by offset rows and pages page0..page1 one column
+        sideways. The vertical area is `rows` rows below the top
+        fixed_rows, which stay put.
+        """
+        if page1 is None:
+            page1 = self.pages - 1
+        if rows is None:
+            rows = self.height - fixed_rows
+        self.write_cmds(bytes((
+            SET_SCROLL_OFF,
+            SET_VSCROLL_AREA, fixed_rows, rows,
+            SET_VHSCROLL_RIGHT if right else SET_VHSCROLL_LEFT,
+            0x00, page0, interval, page1, offset,
+            SET_SCROLL_ON,
+        )))
+        self._scrolling = True
+
+    def scroll_stop(self):
+        # the panel RAM is left shifted, so the next show() resends everything
+        self.write_cmd(SET_SCROLL_OFF)
+        self._scrolling = False
+        self._synced = False
 
     def invert(self, invert):
         self.write_cmd(SET_NORM_INV | (invert & 1))
 
+    def write_cmds(self, seq):
+        # fallback for subclasses without a batched path
+        for cmd in seq:
+            self.write_cmd(cmd)
+
+    def _window(self, x0, x1, page0, page1):
+        w = self._win
+        w[1] = x0
+        w[2] = x1
+        w[4] = page0
+        w[5] = page1
+        self.write_cmds(w)
+
     def show(self):
-        x0 = 0
-        x1 = self.width - 1
-        self.write_cmd(SET_COL_ADDR)
-        self.write_cmd(x0)
-        self.write_cmd(x1)
-        self.write_cmd(SET_PAGE_ADDR)
-        self.write_cmd(0)
-        self.write_cmd(self.pages - 1)
+        """
+        Sends only the changed column range of each changed page.
+        Stops a running hardware scroll first.
+        """
+        if self._scrolling:
+            self.scroll_stop()
+        if not self._synced:
+            self.show_full()
+            return
+        w = self.width
+        try:
+            for page in range(self.pages):
+                span = _dirty_span(self.buffer, self._shadow, page * w, w)
+                if span < 0:
+                    continue
+                x0 = span >> 8
+                x1 = span & 0xFF
+                self._window(x0, x1, page, page)
+                self.write_data(self._mv[page * w + x0:page * w + x1 + 1])
+        except Exception:
+            # the shadow may be ahead of the panel now
+            self._synced = False
+            raise
+
+    def show_full(self):
+        """
+        Sends the whole framebuffer, whatever the panel is believed to show.
+        """
+        if self._scrolling:
+            self.scroll_stop()
+        self._synced = False
+        self._window(0, self.width - 1, 0, self.pages - 1)
         self.write_data(self.buffer)
+        self._shadow[:] = self.buffer
+        self._synced = True
 
     def fill(self, col):
         self.framebuf.fill(col)
@@ -115,6 +239,9 @@ class SSD1306_I2C(SSD1306):
         self.i2c = i2c
         self.addr = addr
         self._temp = bytearray(2)
+        # control byte + data in one transaction without building a new buffer
+        self._vec = [b"\x40", None]
+        self._cmds = [b"\x00", None]
         super().__init__(width, height, external_vcc)
 
     def write_cmd(self, cmd):
@@ -122,12 +249,30 @@ class SSD1306_I2C(SSD1306):
         self._temp[1] = cmd
         self.i2c.writeto(self.addr, self._temp)
 
+    def write_cmds(self, seq):
+        # Co=0: everything after the 0x00 control byte is commands
+        v = self._cmds
+        v[1] = seq
+        try:
+            self.i2c.writevto(self.addr, v)
+        finally:
+            v[1] = None
+
     def write_data(self, buf):
-        self.i2c.writeto(self.addr, b"\x40" + buf)
+        v = self._vec
+        v[1] = buf
+        try:
+            self.i2c.writevto(self.addr, v)
+        finally:
+            v[1] = None
 
 
 class SSD1306_SPI(SSD1306):
-    def __init__(self, width, height, spi, dc, res, cs, external_vcc=False):
+    """
+    shared_bus=True re-applies the SPI settings before every transfer, for
+    buses where another device (e.g. the SD card) runs a different clock.
+    """
+    def __init__(self, width, height, spi, dc, res, cs, external_vcc=False, shared_bus=False):
         self.rate = 10 * 1024 * 1024
         dc.init(dc.OUT, value=0)
         res.init(res.OUT, value=0)
@@ -136,17 +281,31 @@ class SSD1306_SPI(SSD1306):
         self.dc = dc
         self.res = res
         self.cs = cs
+        self.shared_bus = shared_bus
+        self._cmd = bytearray(1)
+        self.spi.init(baudrate=self.rate, polarity=0, phase=0)
         super().__init__(width, height, external_vcc)
 
     def write_cmd(self, cmd):
-        self.spi.init(baudrate=self.rate, polarity=0, phase=0)
+        if self.shared_bus:
+            self.spi.init(baudrate=self.rate, polarity=0, phase=0)
+        self._cmd[0] = cmd
         self.cs.value(0)
         self.dc.value(0)
-        self.spi.write(bytearray([cmd]))
+        self.spi.write(self._cmd)
+        self.cs.value(1)
+
+    def write_cmds(self, seq):
+        if self.shared_bus:
+            self.spi.init(baudrate=self.rate, polarity=0, phase=0)
+        self.cs.value(0)
+        self.dc.value(0)
+        self.spi.write(seq)
         self.cs.value(1)
 
     def write_data(self, buf):
-        self.spi.init(baudrate=self.rate, polarity=0, phase=0)
+        if self.shared_bus:
+            self.spi.init(baudrate=self.rate, polarity=0, phase=0)
         self.cs.value(0)
         self.dc.value(1)
         self.spi.write(buf)
@@ -1,23 +1,203 @@
 import time
 
+# periodic acquisition: measurements per second -> command MSB, then LSB
+# per repeatability (datasheet table 10)
+_PERIODIC = {
+    0.5: (0x20, {"high": 0x32, "medium": 0x24, "low": 0x2F}),
+    1: (0x21, {"high": 0x30, "medium": 0x26, "low": 0x2D}),
+    2: (0x22, {"high": 0x36, "medium": 0x20, "low": 0x2B}),
+    4: (0x23, {"high": 0x34, "medium": 0x22, "low": 0x29}),
+    10: (0x27, {"high": 0x37, "medium": 0x21, "low": 0x2A}),
+}
+# single shot without clock stretching, and its max conversion time (ms)
+_SINGLE_SHOT = {
+    "high": (b"\x24\x00", 15),
+    "medium": (b"\x24\x0B", 6),
+    "low": (b"\x24\x16", 4),
+}
+_FETCH = b"\xE0\x00"
+_BREAK = b"\x30\x93"
+
+
+def _crc8_table():
+    # CRC-8, polynomial 0x31 (x^8 + x^5 + x^4 + 1), init 0xFF, per datasheet 4.12
+    t = bytearray(256)
+    for i in range(256):
+        c = i
+        for _ in range(8):
+            c = ((c << 1) ^ 0x31) if c & 0x80 else (c << 1)
+        t[i] = c & 0xFF
+    return t
+
+
+_CRC8 = _crc8_table()
+
+
+def _word_ok(buf, i):
+    return _CRC8[_CRC8[0xFF ^ buf[i]] ^ buf[i + 1]] == buf[i + 2]
+
 
 class SHT31:
-    def __init__(self, i2c, addr=0x44):
+    """
+    mps=0: single shot, every read waits for its conversion.
+    mps=0.5/1/2/4/10: periodic mode, the sensor measures on its own and a
+    read only fetches the newest result (no wait).
+
+    Non-blocking use: start_measurement(), other work, then collect() until
+    it returns the ticks (None while the conversion is still running).
+    read_raw() does exactly that with a sleep in between.
+
+    Results are CRC checked; a corrupt frame raises OSError and is counted
+    in crc_errors, never returned. The raw ticks come back in one reused
+    list [t_ticks, rh_ticks] (no allocation per read), copy it to keep it.
+    centi_c()/centi_rh() turn ticks into integer hundredths without floats,
+    for callers; the app itself logs the raw ticks.
+    """
+    def __init__(self, i2c, addr=0x44, mps=0, repeatability="high"):
         self.i2c = i2c
         self.addr = addr
+        self.mps = 0
+        self.repeatability = repeatability
+        self._cmd, self.ready_ms = _SINGLE_SHOT[repeatability]
+        self._started_ms = 0
+        self._busy = False
+        self._buf = bytearray(6)
+        self._raw = [0, 0]
+        self.crc_errors = 0
+        self._fresh_ms = 0
+        self._have = False      # periodic: got at least one measurement
+        if mps:
+            self.start_periodic(mps, repeatability)
 
-    def read(self):
-        # Single shot, high repeatability, clock stretching disabled (0x2400)
-        self.i2c.writeto(self.addr, b"\x24\x00")
-        time.sleep_ms(15)
+    def start_periodic(self, mps, repeatability="high"):
+        msb, lsbs = _PERIODIC[mps]
+        if self.mps:
+            self.stop_periodic()
+        else:
+            # after a warm reboot the sensor may still be in periodic mode and
+            # then takes no other command before a break; a sensor that isn't
+            # may NACK it
+            try:
+                self.i2c.writeto(self.addr, _BREAK)
+            except OSError:
+                pass
+            time.sleep_ms(1)
+        self._periodic_cmd = bytes((msb, lsbs[repeatability]))
+        self.i2c.writeto(self.addr, self._periodic_cmd)
+        self.mps = mps
+        self._have = False
+        # a measurement older than two periods means the sensor stopped
+        self._stale_ms = int(2000 / mps) + 50
+        self._fresh_ms = time.ticks_ms()
+
+    def stop_periodic(self):
+        self.i2c.writeto(self.addr, _BREAK)
+        self.mps = 0
+        time.sleep_ms(1)    # break needs 1 ms before the next command
 
-        data = self.i2c.readfrom(self.addr, 6)
-        if len(data) != 6:
-            raise RuntimeError("SHT31 read error")
+    def _unpack(self):
+        data = self._buf
+        if not (_word_ok(data, 0) and _word_ok(data, 3)):
+            self.crc_errors += 1
+            raise OSError("SHT31 CRC error")
+        self._raw[0] = (data[0] << 8) | data[1]
+        self._raw[1] = (data[3] << 8) | data[4]
 
-        t_raw = (data[0] << 8) | data[1]
-        rh_raw = (data[3] << 8) | data[4]
+    def _fetch(self):
+        # periodic mode: NACK on the read = no new measurement since the last fetch
+        self.i2c.writeto(self.addr, _FETCH)
+        try:
+            self.i2c.readfrom_into(self.addr, self._buf)
+        except OSError:
+            if time.ticks_diff(time.ticks_ms(), self._fresh_ms) > self._stale_ms:
+                self._rearm()
+                raise OSError("SHT31 periodic: no new data")
+            return
+        self._unpack()
+        self._have = True
+        self._fresh_ms = time.ticks_ms()
 
+    def _rearm(self):
+        # a sensor reset (brownout, bus glitch) comes back in idle single
+        # shot mode and NACKs every fetch: start periodic mode again.
+        # Nothing is returned until it delivers a new measurement.
+        self._have = False
+        self._fresh_ms = time.ticks_ms()
+        try:
+            self.i2c.writeto(self.addr, _BREAK)
+            time.sleep_ms(1)
+            self.i2c.writeto(self.addr, self._periodic_cmd)
+        except OSError:
+            pass    # still gone, tried again after the next stale period
+
+    def start_measurement(self):
+        """
+        Single shot: send the measure command and return at once.
+        Periodic mode: nothing to do, the sensor is always measuring.
+        """
+        if self.mps:
+            return
+        self.i2c.writeto(self.addr, self._cmd)
+        self._started_ms = time.ticks_ms()
+        self._busy = True
+
+    def collect(self):
+        """
+        Raw (t_ticks, rh_ticks) once the measurement is done, None before
+        (conversion still running, or periodic mode without a first result).
+        """
+        if self.mps:
+            self._fetch()
+            if not self._have:
+                return None
+            return self._raw
+
+        if not self._busy:
+            raise RuntimeError("SHT31: collect() without start_measurement()")
+        if time.ticks_diff(time.ticks_ms(), self._started_ms) < self.ready_ms:
+            return None
+        self._busy = False
+        self.i2c.readfrom_into(self.addr, self._buf)
+        self._unpack()
+        return self._raw
+
+    def read_raw(self):
+        """
+        Returns the raw 16-bit (t_ticks, rh_ticks) words as sent by the sensor.
+        In periodic mode that is the newest measurement (repeated until the
+        sensor has a new one), None before the first one is ready.
+        """
+        self.start_measurement()
+        if not self.mps:
+            time.sleep_ms(self.ready_ms)
+        raw = self.collect()
+        while raw is None and self._busy:
+            time.sleep_ms(1)
+            raw = self.collect()
+        return raw
+
+    # for callers that want integer output (the app logs raw ticks)
+
+    @staticmethod
+    def centi_c(t_raw):
+        # -4500 + 17500 * t / 65535 in hundredths of a degree; / 65536 keeps
+        # it in small ints (error under 1 hundredth, rounding included)
+        return ((t_raw * 4375 + 8192) >> 14) - 4500
+
+    @staticmethod
+    def centi_rh(rh_raw):
+        # 10000 * rh / 65535 in hundredths of a percent, same / 65536 trick
+        # (error under 1 hundredth)
+        return (rh_raw * 625 + 2048) >> 12
+
+    @staticmethod
+    def convert(t_raw, rh_raw):
         temp_c = -45 + (175 * t_raw / 65535.0)
         rh = 100 * rh_raw / 65535.0
         return temp_c, rh
+
+    def read(self):
+        raw = self.read_raw()
+        if raw is None:
+            return None
+        return self.convert(raw[0], raw[1])
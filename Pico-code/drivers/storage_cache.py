@@ -0,0 +1,177 @@
+# drivers/storage_cache.py
+# Block device layers that sit between VfsFat and SDCard
+
+
+class SectorCache:
+    """
+    Small LRU sector cache in front of a block device (SDCard).
+
+    FatFs reads a FAT/directory sector before it changes it, log data is
+    written without being read first. So: sectors come into the cache on
+    read, a write to a cached sector only updates the cache (write-back),
+    a write to anything else goes straight through. Appending rows then
+    costs no re-reads of FAT/directory sectors, and their updates reach
+    the card on sync (file flush/close) or when evicted.
+
+    All sector buffers come from one pool allocated up front.
+    """
+    def __init__(self, dev, sectors=8):
+        self.dev = dev
+        self._pool = bytearray(512 * sectors)
+        mv = memoryview(self._pool)
+        self._bufs = [mv[i * 512:(i + 1) * 512] for i in range(sectors)]
+        self._block = [-1] * sectors
+        self._used = [0] * sectors          # LRU stamps
+        self._dirty = bytearray(sectors)
+        self._clock = 0
+        # counters
+        self.hits = 0
+        self.misses = 0
+        self.writebacks = 0
+
+    def _find(self, block_num):
+        blocks = self._block
+        for i in range(len(blocks)):
+            if blocks[i] == block_num:
+                return i
+        return -1
+
+    def _touch(self, i):
+        self._clock += 1
+        self._used[i] = self._clock
+
+    def _write_back(self, i):
+        if self._dirty[i]:
+            self.dev.writeblocks(self._block[i], self._bufs[i])
+            self._dirty[i] = 0
+            self.writebacks += 1
+
+    def _victim(self):
+        used = self._used
+        v = 0
+        for i in range(1, len(used)):
+            if used[i] < used[v]:
+                v = i
+        self._write_back(v)
+        return v
+
+    def flush(self):
+        for i in range(len(self._block)):
+            self._write_back(i)
+
+    def readblocks(self, block_num, buf):
+        if len(buf) == 512:
+            i = self._find(block_num)
+            if i >= 0:
+                self.hits += 1
+            else:
+                self.misses += 1
+                i = self._victim()
+                self._block[i] = -1     # stays invalid if the read fails
+                self.dev.readblocks(block_num, self._bufs[i])
+                self._block[i] = block_num
+            self._touch(i)
+            buf[:] = self._bufs[i]
+            return
+
+        # multi-block: from the card, then patch in newer cached copies
+        self.dev.readblocks(block_num, buf)
+        mv = None
+        for i in range(len(self._block)):
+            n = self._block[i] - block_num
+            if self._dirty[i] and 0 <= n < len(buf) // 512:
+                if mv is None:
+                    mv = memoryview(buf)
+                mv[n * 512:(n + 1) * 512] = self._bufs[i]
+
+    def writeblocks(self, block_num, buf):
+        if len(buf) == 512:
+            i = self._find(block_num)
+            if i >= 0:
+                self._bufs[i][:] = buf
+                self._dirty[i] = 1
+                self._touch(i)
+                return
+            self.dev.writeblocks(block_num, buf)
+            return
+
+        self.dev.writeblocks(block_num, buf)
+        # keep cached copies in line with what is now on the card
+        mv = None
+        for i in range(len(self._block)):
+            n = self._block[i] - block_num
+            if 0 <= n < len(buf) // 512:
+                if mv is None:
+                    mv = memoryview(buf)
+                self._bufs[i][:] = mv[n * 512:(n + 1) * 512]
+                self._dirty[i] = 0
+
+    def ioctl(self, op, arg):
+        if op == 3:     # sync
+            self.flush()
+        elif op == 6:   # erase: the cached copy would be stale
+            i = self._find(arg)
+            if i >= 0:
+                self._block[i] = -1
+                self._dirty[i] = 0
+        elif op == 2:   # deinit
+            self.flush()
+        return self.dev.ioctl(op, arg)
+
+
+class WriteCoalescer:
+    """
+    Holds back single-sector writes to consecutive blocks and sends them as
+    one multi-block (CMD25) write. VfsFat mostly writes a sector at a time;
+    per sector a multi-block write is several times cheaper on most cards.
+
+    Pending sectors go out when a write isn't adjacent, on any read, on
+    sync/deinit/erase, or when max_sectors are waiting.
+    """
+    def __init__(self, dev, max_sectors=8):
+        self.dev = dev
+        self._buf = bytearray(512 * max_sectors)
+        mv = memoryview(self._buf)
+        # views for every possible pending length, so flush() allocates nothing
+        self._views = [mv[:n * 512] for n in range(max_sectors + 1)]
+        self._slots = [mv[i * 512:(i + 1) * 512] for i in range(max_sectors)]
+        self._start = 0
+        self._count = 0
+        # counters
+        self.transfers = 0
+        self.sectors = 0
+
+    def flush(self):
+        n = self._count
+        if not n:
+            return
+        # dropped even if the write fails; the error reaches the caller
+        self._count = 0
+        self.dev.writeblocks(self._start, self._views[n])
+        self.transfers += 1
+        self.sectors += n
+
+    def readblocks(self, block_num, buf):
+        self.flush()
+        self.dev.readblocks(block_num, buf)
+
+    def writeblocks(self, block_num, buf):
+        if len(buf) != 512:
+            self.flush()
+            self.dev.writeblocks(block_num, buf)
+            self.transfers += 1
+            self.sectors += len(buf) // 512
+            return
+        if self._count and block_num != self._start + self._count:
+            self.flush()
+        if not self._count:
+            self._start = block_num
+        self._slots[self._count][:] = buf
+        self._count += 1
+        if self._count == len(self._slots):
+            self.flush()
+
+    def ioctl(self, op, arg):
+        if op in (2, 3, 6):     # deinit, sync, erase
+            self.flush()
+        return self.dev.ioctl(op, arg)
@@ -1,6 +1,9 @@
 # drivers/storage_sdcard.py
 # SD card driver for SPI on MicroPython (block device for VfsFat)
 import time
+from array import array
+
+import micropython
 
 _CMD_TIMEOUT = 100
 _R1_IDLE_STATE = 1
@@ -10,14 +13,119 @@ _TOKEN_CMD25 = 0xFC
 _TOKEN_STOP_TRAN = 0xFD
 _TOKEN_DATA = 0xFE
 
+# bytes clocked per poll while waiting for a data token / end of busy
+_POLL_WINDOW = 8
+
+# CSD TRAN_SPEED byte: rate unit (bits 2:0) x time value / 10 (bits 6:3)
+_TRAN_UNIT = (100_000, 1_000_000, 10_000_000, 100_000_000)
+_TRAN_VALUE = (0, 10, 12, 13, 15, 20, 25, 30, 35, 40, 45, 50, 55, 60, 70, 80)
+
+# data response (low 5 bits) when the card saw a bad CRC16
+_DATA_CRC_ERROR = 0x0B
+
+# block device ioctl ops (MicroPython vfs protocol)
+_IOCTL_INIT = 1
+_IOCTL_DEINIT = 2
+_IOCTL_SYNC = 3
+_IOCTL_BLK_COUNT = 4
+_IOCTL_BLK_SIZE = 5
+_IOCTL_BLK_ERASE = 6
+
+
+def _crc7_table():
+    # CRC7 (x^7 + x^3 + 1) kept shifted left by one, ready for the command byte
+    t = bytearray(256)
+    for i in range(256):
+        c = i
+        for _ in range(8):
+            c = ((c << 1) ^ 0x12) if c & 0x80 else (c << 1)
+        t[i] = c & 0xFF
+    return t
+
+
+def _crc16_table():
+    # CRC16-CCITT (x^16 + x^12 + x^5 + 1, init 0) as used for data blocks
+    t = array("H", bytes(512))
+    for i in range(256):
+        c = i << 8
+        for _ in range(8):
+            c = ((c << 1) ^ 0x1021) if c & 0x8000 else (c << 1)
+        t[i] = c & 0xFFFF
+    return t
+
+
+_CRC7 = _crc7_table()
+_CRC16 = _crc16_table()
+
+
+def _crc7(buf, n):
+    crc = 0
+    for i in range(n):
+        crc = _CRC7[crc ^ buf[i]]
+    return crc | 1
+
+
+@micropython.viper
+def _crc16(buf, n: int) -> int:
+    # ~0.1 ms per block on the RP2040 instead of a few ms in bytecode
+    p = ptr8(buf)
+    t = ptr16(_CRC16)
+    crc = 0
+    for i in range(n):
+        crc = ((crc << 8) & 0xFFFF) ^ t[((crc >> 8) ^ p[i]) & 0xFF]
+    return crc
+
+
+@micropython.viper
+def _copy(dst, dst_off: int, src, src_off: int, n: int):
+    # block to/from a caller's buffer at an offset, without a memoryview slice
+    d = ptr8(dst)
+    s = ptr8(src)
+    for i in range(n):
+        d[dst_off + i] = s[src_off + i]
+
+
+# SPI clocks tried by negotiate(), slowest first; the RP2040 rounds each to
+# the nearest clk_peri divider it can do
+_CLOCK_STEPS = (
+    2_000_000, 4_000_000, 8_000_000, 12_000_000,
+    16_000_000, 20_000_000, 25_000_000, 31_250_000, 50_000_000,
+)
+
 
 class SDCard:
-    def __init__(self, spi, cs, baudrate=1_000_000):
+    def __init__(self, spi, cs, baudrate=1_000_000, crc=False, retries=2):
         self.spi = spi
         self.cs = cs
         self.cs.init(self.cs.OUT, value=1)
         self.baudrate = baudrate
+        self.min_baudrate = baudrate    # known good, floor for fallbacks
+        self.crc = crc                  # CMD59 CRC mode, checked in _init_card
+        self.max_retries = retries      # per block, before dropping a clock step
+        # counters
+        self.fallbacks = 0
+        self.retries = 0
+        self.crc_errors = 0
+        self._done = 0                  # blocks finished by the current transfer
         self.cdv = 512  # may become 1 for SDHC/SDXC
+        self._nblocks = 0  # from the CSD, read once
+        self._active = True
+
+        # preallocated so the block hot path doesn't touch the heap
+        self._cmdbuf = bytearray(6)
+        self._tokenbuf = bytearray(1)
+        self._pollbuf = bytearray(1)
+        self._window = bytearray(_POLL_WINDOW)
+        self._crcbuf = bytearray(2)
+        self._txcrc = bytearray(b"\xFF\xFF")
+        self._csd = bytearray(16)
+        # one block + its CRC; a block read lands here behind whatever part
+        # of it came in with the token's poll window (one view per length)
+        self._blk = bytearray(514)
+        mv = memoryview(self._blk)
+        self._blk_data = mv[:512]
+        self._blk_tails = [mv[n:] for n in range(_POLL_WINDOW)]
+
         self._init_card()
 
     def _init_spi(self, baudrate):
@@ -29,37 +137,47 @@ class SDCard:
     def _deselect(self):
         self.cs(1)
 
+    def _poll(self):
+        # one byte clocked out as 0xFF, no allocation
+        self.spi.readinto(self._pollbuf, 0xFF)
+        return self._pollbuf[0]
+
     def _wait_ready(self, timeout=500):
+        # busy is signalled by 0x00 and ends with 0xFF, and stays 0xFF after
+        # that, so a whole window can be clocked per poll
+        w = self._window
         start = time.ticks_ms()
         while True:
-            if self.spi.read(1, 0xFF)[0] == 0xFF:
+            self.spi.readinto(w, 0xFF)
+            if w[_POLL_WINDOW - 1] == 0xFF:
                 return True
             if time.ticks_diff(time.ticks_ms(), start) >= timeout:
                 return False
 
     def _cmd(self, cmd, arg, crc=0x95):
         self._deselect()
-        self.spi.read(1, 0xFF)
+        self._poll()
         self._select()
         self._wait_ready()
 
-        buf = bytearray(6)
+        buf = self._cmdbuf
         buf[0] = 0x40 | cmd
         buf[1] = (arg >> 24) & 0xFF
         buf[2] = (arg >> 16) & 0xFF
         buf[3] = (arg >> 8) & 0xFF
         buf[4] = arg & 0xFF
-        buf[5] = crc
+        buf[5] = _crc7(buf, 5) if self.crc else crc
         self.spi.write(buf)
 
+        # byte by byte: R3/R7 payload follows the R1 byte directly
         for _ in range(_CMD_TIMEOUT):
-            r = self.spi.read(1, 0xFF)[0]
+            r = self._poll()
             if not (r & 0x80):
                 return r
         return -1
 
-    def _cmd_nodata(self, cmd, arg):
-        r = self._cmd(cmd, arg)
+    def _cmd_nodata(self, cmd, arg, crc=0x95):
+        r = self._cmd(cmd, arg, crc)
         self._deselect()
         return r
 
@@ -77,7 +195,7 @@ class SDCard:
 
         r = self._cmd(8, 0x1AA, 0x87)  # CMD8
         if not (r & _R1_ILLEGAL_COMMAND):
-            self.spi.read(4, 0xFF)
+            self.spi.read(4, 0xFF)  # init only, allocation doesn't matter here
 
         # ACMD41 init loop
         for _ in range(1000):
@@ -104,91 +222,367 @@ class SDCard:
             if r != 0:
                 raise OSError("CMD16 failed")
 
+        # CMD59: from here on the card checks command and data CRCs
+        if self.crc:
+            self.crc = self._cmd_nodata(59, 1) == 0
+
         # switch to normal speed
         self._init_spi(self.baudrate)
 
+    # --- clock negotiation ---
+
+    def _read_csd(self):
+        if self._cmd(9, 0, 0xFF) != 0:  # CMD9 read CSD
+            self._deselect()
+            raise OSError("CSD read failed (CMD9)")
+        self._readinto(self._csd)
+        self._deselect()
+        return self._csd
+
+    def rated_baudrate(self) -> int:
+        """
+        Card's maximum clock from CSD TRAN_SPEED (25 MHz for nearly all cards,
+        50 MHz for high speed ones).
+        """
+        ts = self._read_csd()[3]
+        return _TRAN_UNIT[min(ts & 0x07, 3)] * _TRAN_VALUE[(ts >> 3) & 0x0F] // 10
+
+    def _resync(self):
+        # get the card out of whatever a failed transfer left it in: stop token
+        # for an open CMD25, CMD12 for an open CMD18 (both ignored otherwise)
+        self._select()
+        self._write_token(_TOKEN_STOP_TRAN)
+        self._wait_ready()
+        self._deselect()
+        for _ in range(4):
+            self._poll()
+        self._cmd_nodata(12, 0)
+        self._select()
+        self._wait_ready()
+        self._deselect()
+        self._poll()
+
+    def _set_clock(self, baudrate):
+        self.baudrate = baudrate
+        self._init_spi(baudrate)
+
+    def _fallback(self) -> bool:
+        # one step down after a failed transfer; False when already at the floor
+        lower = self.min_baudrate
+        for step in _CLOCK_STEPS:
+            if lower < step < self.baudrate:
+                lower = step
+        if lower >= self.baudrate:
+            return False
+        self.fallbacks += 1
+        self._set_clock(lower)
+        self._resync()
+        return True
+
+    def _check_clock(self, block, test, back, rounds) -> bool:
+        try:
+            for r in range(rounds):
+                # mix of edges and runs, different every round
+                for i in range(512):
+                    test[i] = ((i * 37) ^ (r * 0x5B)) & 0xFF
+                self._writeblocks(block, test)
+                self._readblocks(block, back)
+                if back != test:
+                    return False
+            return True
+        except OSError:
+            return False
+
+    def negotiate(self, scratch_block, limit=25_000_000, rounds=4) -> int:
+        """
+        Steps the SPI clock up towards the card's TRAN_SPEED (capped at limit).
+        Every step writes test patterns to scratch_block and reads them back;
+        the first step that fails ends the search and the last good clock is
+        kept. The scratch block's contents are restored afterwards.
+        Returns the clock settled on (also in self.baudrate).
+
+        OSError before anything is written if the card has no partition
+        table or scratch_block lies inside a partition: a power cut halfway
+        would leave test patterns in the filesystem.
+        """
+        top = min(self.rated_baudrate(), limit)
+        saved = bytearray(512)
+        test = bytearray(512)
+        back = bytearray(512)
+        self._check_scratch(scratch_block, saved)
+        self._readblocks(scratch_block, saved)
+
+        good = self.baudrate
+        for step in _CLOCK_STEPS:
+            if step <= good or step > top:
+                continue
+            self._set_clock(step)
+            if not self._check_clock(scratch_block, test, back, rounds):
+                self._set_clock(good)
+                self._resync()
+                break
+            good = step
+
+        # restore at a speed that just passed, and make sure it stuck
+        self._writeblocks(scratch_block, saved)
+        self._readblocks(scratch_block, back)
+        if back != saved:
+            raise OSError("scratch block restore failed")
+        return good
+
+    def _check_scratch(self, block, mbr):
+        self._readblocks(0, mbr)
+        if mbr[510] != 0x55 or mbr[511] != 0xAA or mbr[0] in (0xEB, 0xE9):
+            raise OSError("no partition table, no safe scratch block")
+        if block == 0:
+            raise OSError("scratch block is the MBR")
+        for i in range(4):
+            off = 446 + 16 * i
+            if not mbr[off + 4]:
+                continue
+            lba = mbr[off + 8] | mbr[off + 9] << 8 | mbr[off + 10] << 16 | mbr[off + 11] << 24
+            count = mbr[off + 12] | mbr[off + 13] << 8 | mbr[off + 14] << 16 | mbr[off + 15] << 24
+            if lba <= block < lba + count:
+                raise OSError("scratch block inside partition %d" % (i + 1))
+
+    # --- block device ---
+
     def readblocks(self, block_num, buf):
+        self._transfer(False, block_num, buf)
+
+    def writeblocks(self, block_num, buf):
+        self._transfer(True, block_num, buf)
+
+    def _transfer(self, write, block_num, buf):
+        # A failed block (CRC, token, timeout) is retried from where the
+        # transfer stopped; after max_retries in a row the clock drops a
+        # step, and at the floor the error goes to the caller.
+        # write is a flag, not a method: a bound method is a heap object
+        tries = 0
+        while True:
+            self._done = 0
+            try:
+                if write:
+                    return self._writeblocks(block_num, buf)
+                return self._readblocks(block_num, buf)
+            except OSError:
+                self._resync()
+                if self._done:
+                    # keep what made it (only allocates on this error path)
+                    buf = memoryview(buf)[self._done * 512:]
+                    block_num += self._done
+                    tries = 0
+                tries += 1
+                if tries <= self.max_retries:
+                    self.retries += 1
+                elif self._fallback():
+                    tries = 0
+                else:
+                    raise
+
+    def _readblocks(self, block_num, buf):
         nblocks = len(buf) // 512
         addr = block_num * self.cdv
 
         if nblocks == 1:
             if self._cmd(17, addr, 0xFF) != 0:
                 raise OSError("read error (CMD17)")
-            self._readinto(buf)
+            self._read_block(buf, 0)
+            self._done = 1
         else:
             if self._cmd(18, addr, 0xFF) != 0:
                 raise OSError("read error (CMD18)")
             offset = 0
             for _ in range(nblocks):
-                self._readinto(memoryview(buf)[offset:offset + 512])
+                self._read_block(buf, offset)
                 offset += 512
+                self._done += 1
             self._cmd_nodata(12, 0)  # CMD12 stop
 
-    def writeblocks(self, block_num, buf):
+    def _writeblocks(self, block_num, buf):
         nblocks = len(buf) // 512
         addr = block_num * self.cdv
 
         if nblocks == 1:
             if self._cmd(24, addr, 0xFF) != 0:
                 raise OSError("write error (CMD24)")
-            self._write(memoryview(buf))
+            self._write(buf)
+            self._done = 1
         else:
             if self._cmd(25, addr, 0xFF) != 0:
                 raise OSError("write error (CMD25)")
             offset = 0
             for _ in range(nblocks):
-                self._write_token(_TOKEN_CMD25)
-                self._write(memoryview(buf)[offset:offset + 512])
+                self._write_at(buf, offset, _TOKEN_CMD25)
                 offset += 512
+                self._done += 1
             self._write_token(_TOKEN_STOP_TRAN)
 
         self._deselect()
-        self.spi.read(1, 0xFF)
+        self._poll()
+
+    # --- streaming (open-ended CMD25), used by app/rawlog.py ---
+
+    def stream_begin(self, block_num, erase_hint=0):
+        """
+        Start an open-ended multi-block write at block_num.
+        erase_hint > 0 is sent as ACMD23 (SET_WR_BLK_ERASE_COUNT) so the card can
+        pre-erase that many blocks. The card stays selected until stream_end(),
+        so nothing else may use it in between.
+        """
+        if erase_hint:
+            self._cmd(55, 0, 0xFF)                              # CMD55
+            self._cmd(23, min(erase_hint, 0x7FFFFF), 0xFF)      # ACMD23 (hint only)
+        if self._cmd(25, block_num * self.cdv, 0xFF) != 0:
+            self._deselect()
+            raise OSError("write error (CMD25)")
 
-    def ioctl(self, op, arg):
-        # op=4: return number of blocks
-        if op == 4:
-            if self._cmd(9, 0, 0xFF) != 0:  # CMD9 read CSD
-                return 0
-            csd = bytearray(16)
-            self._readinto(csd)
+    def stream_write(self, buf):
+        # whole 512-byte blocks only
+        for offset in range(0, len(buf), 512):
+            self._write_at(buf, offset, _TOKEN_CMD25)
+
+    def stream_end(self):
+        self._write_token(_TOKEN_STOP_TRAN)
+        self._poll()
+        ok = self._wait_ready()
+        self._deselect()
+        self._poll()
+        if not ok:
+            raise OSError("timeout after CMD25 stop")
+
+    def erase(self, block_num, count=1, timeout=30_000):
+        """
+        CMD32/33/38 erase of count blocks. Erased blocks read back as all 0x00
+        or all 0xFF depending on the card; later writes to them skip the
+        card's own erase, so clearing a log region on the ground keeps
+        in-flight write latency down. Big ranges can take seconds.
+        """
+        if self._cmd_nodata(32, block_num * self.cdv) != 0:              # ERASE_WR_BLK_START
+            raise OSError("erase error (CMD32)")
+        if self._cmd_nodata(33, (block_num + count - 1) * self.cdv) != 0:  # ERASE_WR_BLK_END
+            raise OSError("erase error (CMD33)")
+        if self._cmd(38, 0) != 0:                                        # ERASE
             self._deselect()
+            raise OSError("erase error (CMD38)")
+        ok = self._wait_ready(timeout)
+        self._deselect()
+        self._poll()
+        if not ok:
+            raise OSError("timeout during erase")
 
+    def _block_count(self):
+        if not self._nblocks:
+            csd = self._read_csd()
             if csd[0] >> 6 == 1:
                 c_size = ((csd[7] & 0x3F) << 16) | (csd[8] << 8) | csd[9]
-                nblocks = (c_size + 1) * 1024
+                self._nblocks = (c_size + 1) * 1024
             else:
                 c_size = ((csd[6] & 0x03) << 10) | (csd[7] << 2) | (csd[8] >> 6)
                 c_size_mult = ((csd[9] & 0x03) << 1) | (csd[10] >> 7)
-                nblocks = (c_size + 1) * (2 ** (c_size_mult + 2))
-            return nblocks
+                read_bl_len = csd[5] & 0x0F
+                # in 512-byte blocks (1 GB/2 GB SDSC cards use 1024/2048-byte READ_BL_LEN)
+                self._nblocks = (c_size + 1) << (c_size_mult + 2 + read_bl_len - 9)
+        return self._nblocks
 
+    def ioctl(self, op, arg):
+        if op == _IOCTL_BLK_COUNT:
+            try:
+                return self._block_count()
+            except OSError:
+                return 0
+        if op == _IOCTL_BLK_SIZE:
+            return 512
+        if op == _IOCTL_BLK_ERASE:
+            try:
+                self.erase(arg)
+            except OSError:
+                return -5   # EIO
+            return 0
+        if op == _IOCTL_SYNC:
+            # nothing is held back in the driver, every write is on the card
+            return 0
+        if op == _IOCTL_DEINIT:
+            self._deselect()
+            self._active = False
+            return 0
+        if op == _IOCTL_INIT:
+            # the card is set up by __init__; only redo it after a deinit
+            if not self._active:
+                try:
+                    self._init_card()
+                except OSError:
+                    return -5
+                self._active = True
+            return 0
         return 0
 
-    def _readinto(self, buf):
+    def _token(self):
+        # poll a window at a time for the data token; returns how many of the
+        # window's bytes came after it (already data)
+        w = self._window
         start = time.ticks_ms()
         while True:
-            tok = self.spi.read(1, 0xFF)[0]
-            if tok == _TOKEN_DATA:
+            self.spi.readinto(w, 0xFF)
+            k = 0
+            while k < _POLL_WINDOW and w[k] == 0xFF:
+                k += 1
+            if k < _POLL_WINDOW:
+                if w[k] != _TOKEN_DATA:
+                    raise OSError("bad data token")
                 break
             if time.ticks_diff(time.ticks_ms(), start) > 1000:
                 raise OSError("timeout waiting for data token")
+        return _POLL_WINDOW - k - 1
+
+    def _read_block(self, buf, offset):
+        # one 512-byte block into buf[offset:], through self._blk (no allocation)
+        n = self._token()
+        blk = self._blk
+        _copy(blk, 0, self._window, _POLL_WINDOW - n, n)
+        self.spi.readinto(self._blk_tails[n], 0xFF)
+        if self.crc and (blk[512] << 8 | blk[513]) != _crc16(blk, 512):
+            self.crc_errors += 1
+            raise OSError("data CRC error")
+        _copy(buf, offset, blk, 0, 512)
 
-        mv = memoryview(buf)
-        self.spi.readinto(mv, 0xFF)
-        self.spi.read(2, 0xFF)  # discard CRC
-
-    def _write(self, buf):
-        self._write_token(_TOKEN_DATA)
+    def _readinto(self, buf):
+        # short reads (CSD), not on the block path
+        n = self._token()
+        for i in range(n):
+            buf[i] = self._window[_POLL_WINDOW - n + i]
+        self.spi.readinto(memoryview(buf)[n:], 0xFF)
+        crc = self._crcbuf
+        self.spi.readinto(crc, 0xFF)
+        if self.crc and (crc[0] << 8 | crc[1]) != _crc16(buf, len(buf)):
+            self.crc_errors += 1
+            raise OSError("data CRC error")
+
+    def _write_at(self, buf, offset, token):
+        # block buf[offset:offset + 512] of a multi-block buffer, copied into
+        # self._blk instead of sliced
+        _copy(self._blk, 0, buf, offset, 512)
+        self._write(self._blk_data, token)
+
+    def _write(self, buf, token=_TOKEN_DATA):
+        self._write_token(token)
         self.spi.write(buf)
-        self.spi.write(b"\xFF\xFF")  # dummy CRC
-
-        resp = self.spi.read(1, 0xFF)[0]
-        if (resp & 0x1F) != 0x05:
+        crc = self._txcrc
+        if self.crc:
+            c = _crc16(buf, len(buf))
+            crc[0] = c >> 8
+            crc[1] = c & 0xFF
+        self.spi.write(crc)     # stays 0xFFFF (ignored) without CRC mode
+
+        resp = self._poll() & 0x1F
+        if resp != 0x05:
+            if resp == _DATA_CRC_ERROR:
+                self.crc_errors += 1
             raise OSError("data rejected")
 
         if not self._wait_ready():
             raise OSError("timeout after write")
 
     def _write_token(self, token):
-        self.spi.write(bytearray([token]))
+        self._tokenbuf[0] = token
+        self.spi.write(self._tokenbuf)
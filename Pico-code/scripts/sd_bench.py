@@ -0,0 +1,60 @@
+import gc
+import time
+
+from machine import Pin, SPI
+import config
+from drivers.storage_sdcard import SDCard
+
+# Sectors/s and heap allocation per block for the raw SD driver.
+# Non destructive: reads the last blocks of the card and writes the same
+# data back. Run with nothing else using the card (not mounted).
+ROUNDS = 64
+MULTI = 8     # blocks per multi-block transfer
+
+spi = SPI(
+    config.SD_SPI_ID,
+    baudrate=config.SD_BAUDRATE,
+    polarity=0,
+    phase=0,
+    sck=Pin(config.SD_SCK),
+    mosi=Pin(config.SD_MOSI),
+    miso=Pin(config.SD_MISO),
+)
+sd = SDCard(spi, Pin(config.SD_CS, Pin.OUT), baudrate=config.SD_BAUDRATE,
+            crc=config.SD_CRC, retries=config.SD_RETRIES)
+if config.SD_MAX_BAUDRATE > config.SD_BAUDRATE:
+    try:
+        sd.negotiate(config.SD_SCRATCH_BLOCK, limit=config.SD_MAX_BAUDRATE)
+    except OSError as e:
+        print("clock not negotiated:", e)
+
+first = sd.ioctl(4, 0) - MULTI
+buf1 = bytearray(512)
+bufn = bytearray(512 * MULTI)
+sd.readblocks(first, bufn)
+sd.readblocks(first, buf1)
+
+
+def run(name, fn, buf):
+    nblocks = len(buf) // 512
+    gc.collect()
+    gc.disable()
+    a0 = gc.mem_alloc()
+    t0 = time.ticks_us()
+    for _ in range(ROUNDS):
+        fn(first, buf)
+    us = time.ticks_diff(time.ticks_us(), t0)
+    a1 = gc.mem_alloc()
+    gc.enable()
+    blocks = ROUNDS * nblocks
+    print("%-10s %7.1f sectors/s  %5.1f bytes alloc/block" % (
+        name, blocks * 1_000_000 / us, (a1 - a0) / blocks))
+
+
+print("SD bench @ %d baud (rated %d), %d rounds" % (sd.baudrate, sd.rated_baudrate(), ROUNDS))
+run("read x1", sd.readblocks, buf1)
+run("read x%d" % MULTI, sd.readblocks, bufn)
+run("write x1", sd.writeblocks, buf1)
+run("write x%d" % MULTI, sd.writeblocks, bufn)
+print("crc %s: %d crc errors, %d retries, %d clock fallbacks" % (
+    "on" if sd.crc else "off", sd.crc_errors, sd.retries, sd.fallbacks))
@@ -0,0 +1,305 @@
+"""
+Decoder for the packed .bin logs written by the Pico (Pico-code/app/logformat.py).
+
+    data = load('20251206T121200Z.bin')
+    data['temp'], data['rh']      # physical units (degC, %RH)
+    data['time']                  # unix seconds
+
+Journaled logs (version 2, and delta coded version 3) can be checked/repaired
+after a flight:
+
+    python binlog.py scan /media/<user>/BOREALIS [--repair]
+"""
+import argparse
+import os
+import struct
+import zlib
+
+import numpy as np
+
+MAGIC = b"BRLG"
+HEADER_FMT = "<4sBBHHI"
+HEADER_FIXED_SIZE = struct.calcsize(HEADER_FMT)
+COUNT_OFFSET = 10
+JOURNAL_VERSION = 2
+DELTA_VERSION = 3
+
+# journal batch: payload bytes, flags, file key, batch seq, crc32, then records
+BATCH_SIZE = 512
+BATCH_HEADER_SIZE = 16
+BATCH_DTYPE = np.dtype({
+    "names": ["nbytes", "flags", "key", "seq", "crc"],
+    "formats": ["<u2", "<u2", "<u4", "<u4", "<u4"],
+    "offsets": [0, 2, 4, 8, 12],
+    "itemsize": BATCH_SIZE,
+})
+
+# the Pico counts seconds from 2000-01-01, numpy/matplotlib want unix time
+EPOCH_OFFSET = 946684800
+
+# kind -> ticks to physical units
+CONVERSIONS = {
+    "sht31_t": lambda x: -45 + 175 * x / 65535.0,
+    "sht31_rh": lambda x: 100 * x / 65535.0,
+}
+# kind -> csv column unit ("temp" -> "temp_c"), as in the Pico's csv logs
+UNITS = {
+    "sht31_t": "c",
+    "sht31_rh": "percent",
+}
+
+
+def read_header(buf):
+    """
+    Parses the file header. Returns a dict with version, record_size,
+    header_size, count and channels [(name, kind), ...].
+    """
+    magic, version, nchan, record_size, header_size, count = struct.unpack_from(HEADER_FMT, buf)
+    if magic != MAGIC:
+        raise ValueError("not a Borealis binary log")
+    table = bytes(buf[HEADER_FIXED_SIZE:header_size]).rstrip(b"\0").decode()
+    channels = [tuple(ch.split(":")) for ch in table.split(",")] if table else []
+    if len(channels) != nchan:
+        raise ValueError("corrupt channel table")
+    return {
+        "version": version,
+        "record_size": record_size,
+        "header_size": header_size,
+        "count": count,
+        "channels": channels,
+    }
+
+
+def record_dtype(channels):
+    return np.dtype(
+        [("seq", "<u4"), ("epoch", "<u4"), ("ticks_ms", "<u4")]
+        + [(name, "<u2") for name, kind in channels]
+    )
+
+
+def valid_batches(buf):
+    """
+    Number of leading journal batches in buf (a whole version 2 file) that
+    carry the file's key, consecutive seq numbers and a good CRC - everything
+    after the first bad one is what a power cut left behind.
+    """
+    nb = (len(buf) - BATCH_SIZE) // BATCH_SIZE
+    if nb <= 0:
+        return 0
+    hdr = np.frombuffer(buf, dtype=BATCH_DTYPE, count=nb, offset=BATCH_SIZE)
+    ok = (
+        (hdr["key"] == hdr["key"][0])
+        & (hdr["seq"] == np.arange(nb, dtype=np.uint32))
+        & (hdr["nbytes"] <= BATCH_SIZE - BATCH_HEADER_SIZE)
+    )
+    bad = np.flatnonzero(~ok)
+    n = int(bad[0]) if bad.size else nb
+
+    mv = memoryview(buf)
+    for i in range(n):
+        off = BATCH_SIZE * (i + 1)
+        size = int(hdr["nbytes"][i])
+        crc = zlib.crc32(mv[off:off + 12])
+        crc = zlib.crc32(mv[off + BATCH_HEADER_SIZE:off + BATCH_HEADER_SIZE + size], crc)
+        if crc != hdr["crc"][i]:
+            return i
+    return n
+
+
+def _journal_payload(buf):
+    # concatenated record bytes of all valid batches + payload size per batch
+    n = valid_batches(buf)
+    batches = np.frombuffer(buf, dtype=np.uint8, count=n * BATCH_SIZE, offset=BATCH_SIZE)
+    batches = batches.reshape(n, BATCH_SIZE)[:, BATCH_HEADER_SIZE:]
+    nbytes = np.frombuffer(buf, dtype=BATCH_DTYPE, count=n, offset=BATCH_SIZE)["nbytes"]
+    mask = np.arange(BATCH_SIZE - BATCH_HEADER_SIZE) < nbytes[:, None]
+    return batches[mask], nbytes.astype(np.int64)
+
+
+def _group_cumsum(x, group_start):
+    # cumsum that restarts at every True in group_start (rows there hold absolute values)
+    cs = np.cumsum(x)
+    starts = np.flatnonzero(group_start)
+    base = cs[starts] - x[starts]
+    return cs - np.repeat(base, np.diff(np.append(starts, len(x))))
+
+
+def _decode_delta(payload, nbytes, dtype, nchan):
+    """
+    Vectorized decoder for DeltaEncoder batches (see Pico-code/app/logformat.py).
+    """
+    if not len(payload):
+        # switched OFF before the first sample
+        return np.zeros(0, dtype=dtype)
+    b = payload.astype(np.uint64)
+    ends = np.flatnonzero(payload < 0x80)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    # varint i covers bytes starts[i]..ends[i]; shift each byte by 7 * its position
+    owner = np.repeat(np.arange(len(ends)), ends - starts + 1)
+    pos = np.arange(len(payload)) - starts[owner]
+    ints = np.add.reduceat((b & 0x7F) << (7 * pos).astype(np.uint64), starts).astype(np.int64)
+
+    # every batch: first seq, then rows of (epoch, ticks, channels...)
+    width = nchan + 2
+    batch_of_byte = np.repeat(np.arange(len(nbytes)), nbytes)
+    batch = batch_of_byte[starts]
+    first = np.flatnonzero(np.diff(np.concatenate(([-1], batch))))
+    seq0 = ints[first]
+    body = np.delete(ints, first).reshape(-1, width)
+    rows_per_batch = np.bincount(batch, minlength=len(nbytes))[np.unique(batch)] // width
+    key = np.zeros(len(body), dtype=bool)
+    key[np.concatenate(([0], np.cumsum(rows_per_batch)[:-1]))] = True
+
+    # zigzag on delta rows, keyframe rows are plain
+    zz = np.where(key[:, None], body, (body >> 1) ^ -(body & 1))
+
+    out = np.zeros(len(body), dtype=dtype)
+    out["seq"] = np.repeat(seq0, rows_per_batch) + (np.arange(len(body)) - np.repeat(np.flatnonzero(key), rows_per_batch))
+    out["epoch"] = _group_cumsum(zz[:, 0], key)
+    dt = _group_cumsum(np.where(key, 0, zz[:, 1]), key)
+    out["ticks_ms"] = _group_cumsum(np.where(key, zz[:, 1], dt), key)
+    for i, name in enumerate(dtype.names[3:]):
+        out[name] = _group_cumsum(zz[:, 2 + i], key)
+    return out
+
+
+def decode(buf):
+    """
+    All records in buf (bytes of a whole .bin file); a zero-copy view for
+    plain files. Returns (header, structured array of raw records).
+    """
+    header = read_header(buf)
+    dtype = record_dtype(header["channels"])
+    if dtype.itemsize != header["record_size"]:
+        raise ValueError("record size mismatch")
+    if header["version"] in (JOURNAL_VERSION, DELTA_VERSION):
+        # batches already cut at the last valid one
+        payload, nbytes = _journal_payload(buf)
+        if header["version"] == DELTA_VERSION:
+            records = _decode_delta(payload, nbytes, dtype, len(header["channels"]))
+        else:
+            records = np.frombuffer(payload.tobytes(), dtype=dtype)
+        if header["count"]:
+            records = records[:header["count"]]
+        return header, records
+
+    n = (len(buf) - header["header_size"]) // dtype.itemsize
+    if header["count"]:
+        n = min(n, header["count"])
+    records = np.frombuffer(buf, dtype=dtype, count=n, offset=header["header_size"])
+    if not header["count"]:
+        # not closed cleanly (power cut). Files from older firmware could be
+        # preallocated without the journal and then end in whatever was on the
+        # card; keep only the run of consecutive seq numbers. That can't tell
+        # an older log in reused clusters apart, which is why the Pico now
+        # always journals preallocated files.
+        bad = np.flatnonzero(records["seq"] != np.arange(n, dtype=np.uint32))
+        if bad.size:
+            records = records[:bad[0]]
+    return header, records
+
+
+def load(path):
+    """
+    Reads a .bin log into a dict of column arrays: seq, ticks_ms, time (unix s),
+    plus every channel converted to physical units (raw ticks under '<name>_raw').
+    Samples a sensor missed (its bit clear in a "mask" channel, see
+    Pico-code/app/logformat.py) are NaN in physical units.
+    """
+    with open(path, "rb") as f:
+        buf = f.read()
+    header, records = decode(buf)
+
+    out = {
+        "seq": records["seq"],
+        "ticks_ms": records["ticks_ms"],
+        "time": records["epoch"].astype(np.int64) + EPOCH_OFFSET,
+    }
+    channels = header["channels"]
+    mask = None
+    for name, kind in channels:
+        if kind == "mask":
+            mask = records[name]
+    for i, (name, kind) in enumerate(channels):
+        out[name + "_raw"] = records[name]
+        conv = CONVERSIONS.get(kind)
+        if conv is not None:
+            values = conv(records[name].astype(np.float64))
+            if mask is not None:
+                values[(mask >> i) & 1 == 0] = np.nan
+            out[name] = values
+    return out
+
+
+def to_csv(path, out_path):
+    """
+    Writes the same columns the Pico's csv mode would (utc_iso,temp_c,rh_percent,...),
+    missed samples as empty fields.
+    """
+    with open(path, "rb") as f:
+        channels = read_header(f.read())["channels"]
+    data = load(path)
+    stamps = np.datetime_as_string(data["time"].astype("datetime64[s]"))
+    names = ["utc_iso"]
+    columns = []
+    for name, kind in channels:
+        if kind == "mask":
+            continue
+        unit = UNITS.get(kind)
+        if unit and name in data:
+            names.append(name + "_" + unit)
+            columns.append(["" if np.isnan(v) else "%.2f" % v for v in data[name]])
+        else:
+            names.append(name)
+            columns.append(["%d" % v for v in data[name + "_raw"]])
+    with open(out_path, "w") as f:
+        f.write(",".join(names) + "\n")
+        for i, s in enumerate(stamps):
+            f.write(",".join([s + "Z"] + [c[i] for c in columns]) + "\n")
+
+
+def scan(path, repair=False):
+    """
+    Checks one journaled log the way the Pico does at boot. With repair=True a
+    file that was never closed gets its record count written into the header
+    and is truncated after the last valid batch (which the Pico can't do).
+    Returns (valid batches, records, was_closed).
+    """
+    with open(path, "rb") as f:
+        buf = f.read()
+    header, records = decode(buf)
+    if header["version"] not in (JOURNAL_VERSION, DELTA_VERSION):
+        raise ValueError("not a journaled log")
+    n = valid_batches(buf)
+    closed = bool(header["count"])
+    if repair:
+        with open(path, "r+b") as f:
+            if not closed:
+                f.seek(COUNT_OFFSET)
+                f.write(struct.pack("<I", len(records)))
+            f.truncate(BATCH_SIZE * (n + 1))
+    return n, len(records), closed
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sc = sub.add_parser("scan", help="check journaled logs on a card (or single files)")
+    sc.add_argument("paths", nargs="+", help=".bin files or directories")
+    sc.add_argument("--repair", action="store_true", help="fix header + truncate garbage tail")
+    args = ap.parse_args()
+
+    for p in args.paths:
+        files = [os.path.join(p, n) for n in sorted(os.listdir(p)) if n.endswith(".bin")] if os.path.isdir(p) else [p]
+        for path in files:
+            try:
+                n, count, closed = scan(path, args.repair)
+            except ValueError as e:
+                print("%s: skipped (%s)" % (path, e))
+                continue
+            print("%s: %d batches, %d records%s" % (
+                path, n, count, "" if closed else " (not closed, %s)" % ("repaired" if args.repair else "needs repair")))
+
+
+if __name__ == "__main__":
+    main()
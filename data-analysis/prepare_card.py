@@ -0,0 +1,83 @@
+"""
+Prepares an SD card for the Pico logger (Linux, needs sfdisk + mkfs.fat).
+
+    python prepare_card.py format /dev/sdX [--raw [--raw-start 4194304]]
+        New MBR with one FAT32 partition (32 KiB clusters). With --raw the
+        partition ends at --raw-start (default config.RAW_LOG_START_BLOCK)
+        and the rest of the card is left for the raw logging backend.
+        ERASES THE WHOLE CARD.
+
+    python prepare_card.py slots /media/<user>/BOREALIS [--count 8] [--size-mb 4]
+        Lays out zero-filled files in /prealloc on the mounted card. Written
+        back to back on a fresh filesystem they get contiguous clusters; the
+        logger renames one per session instead of allocating clusters in flight.
+        --size-mb should match config.LOG_PREALLOC_BYTES.
+"""
+import argparse
+import os
+import subprocess
+
+from rawcard import DEFAULT_START_BLOCK
+
+PARTITION_START = 8192      # sectors, 4 MiB aligned like factory formatted cards
+CHUNK = 1024 * 1024
+
+
+def partition_path(dev):
+    # /dev/sdb -> /dev/sdb1, /dev/mmcblk0 -> /dev/mmcblk0p1
+    return dev + ("p1" if dev[-1].isdigit() else "1")
+
+
+def format_card(dev, raw_start=None):
+    # raw_start: the partition ends there (sectors), None = it fills the card
+    size = ""
+    if raw_start is not None:
+        if raw_start <= PARTITION_START:
+            raise SystemExit("--raw-start must be past block %d" % PARTITION_START)
+        size = "%d" % (raw_start - PARTITION_START)
+    table = "label: dos\nstart=%d, size=%s, type=c\n" % (PARTITION_START, size)
+    subprocess.run(["sfdisk", dev], input=table.encode(), check=True)
+    subprocess.run(["mkfs.fat", "-F", "32", "-s", "64", "-n", "BOREALIS", partition_path(dev)], check=True)
+
+
+def make_slots(mount, count=8, size_mb=4):
+    d = os.path.join(mount, "prealloc")
+    os.makedirs(d, exist_ok=True)
+    for name in os.listdir(d):
+        os.remove(os.path.join(d, name))
+
+    zeros = bytes(CHUNK)
+    for i in range(count):
+        path = os.path.join(d, "SLOT%03d.BIN" % i)
+        with open(path, "wb") as f:
+            for _ in range(size_mb):
+                f.write(zeros)
+            f.flush()
+            os.fsync(f.fileno())
+        print(path)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    fmt = sub.add_parser("format", help="partition + mkfs.fat (erases the card)")
+    fmt.add_argument("device", help="whole card, e.g. /dev/sdb (not a partition)")
+    fmt.add_argument("--raw", action="store_true", help="leave the end of the card for raw logging")
+    fmt.add_argument("--raw-start", type=int, default=DEFAULT_START_BLOCK,
+                     help="first raw log block, the FAT partition ends before it")
+
+    slots = sub.add_parser("slots", help="lay out preallocated log files")
+    slots.add_argument("mount", help="where the card is mounted")
+    slots.add_argument("--count", type=int, default=8)
+    slots.add_argument("--size-mb", type=int, default=4)
+
+    args = ap.parse_args()
+    if args.cmd == "format":
+        format_card(args.device, args.raw_start if args.raw else None)
+    else:
+        make_slots(args.mount, args.count, args.size_mb)
+
+
+if __name__ == "__main__":
+    main()
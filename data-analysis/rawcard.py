@@ -0,0 +1,97 @@
+"""
+Pulls raw-logged sessions (Pico-code/app/rawlog.py) out of an SD card image.
+
+    python rawcard.py card.img                      # list sessions
+    python rawcard.py card.img --extract out/       # one .bin per session
+    python rawcard.py /dev/sdX --start 4194304 ...  # works on the device too
+
+Each extracted file is a normal binary log, readable with binlog.load().
+"""
+import argparse
+import os
+import struct
+
+BLOCK_SIZE = 512
+DEFAULT_START_BLOCK = 4194304   # keep in sync with config.RAW_LOG_START_BLOCK
+
+SB_MAGIC = b"BRSB"
+SB_FMT = "<4sHHII"
+SB_SIZE = 16
+SESSION_FMT = "<IIII"
+SESSION_SIZE = 16
+BLOCK_FMT = "<IIHH"
+BLOCK_HEADER_SIZE = 12
+
+EPOCH_OFFSET = 946684800
+
+
+def read_block(f, n):
+    f.seek(n * BLOCK_SIZE)
+    return f.read(BLOCK_SIZE)
+
+
+def read_superblock(f, start_block=DEFAULT_START_BLOCK):
+    """
+    Returns a list of sessions: dicts with index, start, blocks, epoch, key.
+    blocks is None for a session the Pico never closed (power cut).
+    """
+    sb = read_block(f, start_block)
+    magic, version, count, start, nblocks = struct.unpack_from(SB_FMT, sb)
+    if magic != SB_MAGIC or start != start_block:
+        raise ValueError("no raw log superblock at block %d" % start_block)
+    sessions = []
+    for i in range(count):
+        s, n, epoch, key = struct.unpack_from(SESSION_FMT, sb, SB_SIZE + i * SESSION_SIZE)
+        sessions.append({
+            "index": i,
+            "start": s,
+            "blocks": n or None,
+            "epoch": epoch + EPOCH_OFFSET if epoch else None,
+            "key": key,
+            "region_end": start + nblocks,
+        })
+    return sessions
+
+
+def session_payload(f, session):
+    """
+    Concatenated payloads of one session (= the .bin log the Pico streamed).
+    Stops at the first block that doesn't belong to the session, so sessions
+    cut off by a power loss come out up to their last complete block.
+    """
+    limit = session["blocks"] or (session["region_end"] - session["start"])
+    out = bytearray()
+    for i in range(limit):
+        blk = read_block(f, session["start"] + i)
+        if len(blk) < BLOCK_SIZE:
+            break
+        key, seq, n, _ = struct.unpack_from(BLOCK_FMT, blk)
+        if key != session["key"] or seq != i or n > BLOCK_SIZE - BLOCK_HEADER_SIZE:
+            break
+        out += blk[BLOCK_HEADER_SIZE:BLOCK_HEADER_SIZE + n]
+    return bytes(out)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("image", help="card image or block device")
+    ap.add_argument("--start", type=int, default=DEFAULT_START_BLOCK, help="first block of the raw region")
+    ap.add_argument("--extract", metavar="DIR", help="write session_<n>.bin files here")
+    args = ap.parse_args()
+
+    with open(args.image, "rb") as f:
+        sessions = read_superblock(f, args.start)
+        for s in sessions:
+            print("session %d: start block %d, %s blocks, key %08x" % (
+                s["index"], s["start"], s["blocks"] or "? (not closed)", s["key"]))
+            if args.extract:
+                os.makedirs(args.extract, exist_ok=True)
+                data = session_payload(f, s)
+                path = os.path.join(args.extract, "session_%03d.bin" % s["index"])
+                with open(path, "wb") as out:
+                    out.write(data)
+                print("  -> %s (%d bytes)" % (path, len(data)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Reads the manifest.csv the Pico appends to on the card, so a time window can
+be loaded without listing or parsing every log file.
+
+    segs = segments('/media/<user>/BOREALIS')
+    data = load_window('/media/<user>/BOREALIS', t0, t1)   # unix seconds
+
+    python sessions.py /media/<user>/BOREALIS              # overview
+"""
+import argparse
+import csv
+import os
+import time
+
+import numpy as np
+
+import binlog
+
+
+def segments(card):
+    """
+    One dict per segment: session, segment, file, start, end (unix s, None if
+    unknown), records (None if the segment was never closed).
+    """
+    segs = {}
+    with open(os.path.join(card, "manifest.csv"), newline="") as f:
+        for row in csv.DictReader(f):
+            key = (int(row["session"]), int(row["segment"]))
+            epoch = int(row["epoch"])
+            t = epoch + binlog.EPOCH_OFFSET if epoch else None
+            if row["event"] == "open":
+                segs[key] = {
+                    "session": key[0], "segment": key[1], "file": row["file"],
+                    "start": t, "end": None, "records": None,
+                }
+            elif key not in segs:
+                continue
+            elif row["event"] == "resume":
+                # switched back ON quickly: appended to, open again
+                segs[key]["end"] = None
+                segs[key]["records"] = None
+            else:
+                segs[key]["end"] = t
+                segs[key]["records"] = int(row["records"])
+    return [segs[k] for k in sorted(segs)]
+
+
+def in_window(segs, t0=None, t1=None):
+    """
+    Segments that may hold samples in [t0, t1]. Unknown ends count as open-ended.
+    """
+    out = []
+    for s in segs:
+        if t1 is not None and s["start"] is not None and s["start"] > t1:
+            continue
+        if t0 is not None and s["end"] is not None and s["end"] < t0:
+            continue
+        out.append(s)
+    return out
+
+
+def load_window(card, t0=None, t1=None):
+    """
+    binlog.load() of every .bin segment overlapping [t0, t1], concatenated and
+    cut to the window.
+    """
+    parts = [binlog.load(os.path.join(card, s["file"]))
+             for s in in_window(segments(card), t0, t1) if s["file"].endswith(".bin")]
+    if not parts:
+        return {}
+    data = {k: np.concatenate([p[k] for p in parts]) for k in parts[0]}
+    mask = np.ones(len(data["time"]), dtype=bool)
+    if t0 is not None:
+        mask &= data["time"] >= t0
+    if t1 is not None:
+        mask &= data["time"] <= t1
+    return {k: v[mask] for k, v in data.items()}
+
+
+def _fmt(t):
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(t)) if t else "?"
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("card", help="mounted card (directory with manifest.csv)")
+    args = ap.parse_args()
+    for s in segments(args.card):
+        print("session %3d seg %3d  %s  %s -> %s  %s records" % (
+            s["session"], s["segment"], s["file"], _fmt(s["start"]), _fmt(s["end"]),
+            "?" if s["records"] is None else s["records"]))
+
+
+if __name__ == "__main__":
+    main()